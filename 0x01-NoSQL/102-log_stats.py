@@ -1,31 +1,228 @@
 #!/usr/bin/env python3
-"""script that provides some stats about Nginx logs stored in MongoDB"""
-from pymongo import MongoClient
+"""script that provides some stats about Nginx logs stored in MongoDB
 
+With --incremental, running totals are kept in the nginx_stats and
+nginx_stats_ips collections and each run only reads the logs added
+since the previous one. With --approximate, the logs are read in one
+streaming pass and the top IPs and the number of distinct IPs are
+estimated with fixed-memory sketches, for collections with too many
+distinct IPs to group them all. With --parallel, the collection is
+split into _id ranges that are aggregated at the same time by a pool
+of worker processes.
+"""
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from log_sketches import HyperLogLog, SpaceSaving
+count_stage = __import__('12-log_stats').count_stage
+METHODS = __import__('12-log_stats').METHODS
 
-if __name__ == "__main__":
-    """main script"""
-    client = MongoClient("mongodb://127.0.0.1:27017")
-    logs_collection = client.logs.nginx
-    methods = ["GET", "POST", "PUT", "PATCH", "DELETE"]
-    all_logs = logs_collection.count_documents({})
-    print(f"{all_logs} logs")
+
+def log_stats(logs_collection, top=10):
+    """computes the counts of 12-log_stats and the top IPs
+    in one $facet aggregation, so the collection is read once"""
+    pipeline = [{"$facet": {
+        "counts": [count_stage()],
+        "ips": [
+            {"$group": {"_id": "$ip", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": top},
+        ],
+    }}]
+    result = next(logs_collection.aggregate(pipeline, allowDiskUse=True))
+    stats = {"total": 0, "status": 0, **dict.fromkeys(METHODS, 0)}
+    for counts in result["counts"]:
+        stats.update({key: counts[key] for key in stats})
+    stats["ips"] = [(ip["_id"], ip["count"]) for ip in result["ips"]]
+    return stats
+
+
+def approximate_log_stats(logs_collection, top=10, error=0.0001,
+                          distinct_error=0.01):
+    """computes the stats of log_stats in one streaming pass, with the
+    top IPs estimated by a Space-Saving sketch, whose counts are at most
+    error times the number of logs too high, and the number of distinct
+    IPs estimated by a HyperLogLog of standard error distinct_error;
+    memory is fixed by the errors, whatever the number of IPs"""
+    stats = {"total": 0, "status": 0, **dict.fromkeys(METHODS, 0)}
+    heavy_hitters = SpaceSaving(error)
+    distinct = HyperLogLog(distinct_error)
+    logs = logs_collection.find(
+        {}, {"_id": 0, "ip": 1, "method": 1, "path": 1}, batch_size=10000)
+    for log in logs:
+        method = log.get("method")
+        stats["total"] += 1
+        if method in stats:
+            stats[method] += 1
+        if method == "GET" and log.get("path") == "/status":
+            stats["status"] += 1
+        heavy_hitters.add(log.get("ip"))
+        distinct.add(log.get("ip"))
+    stats["ips"] = heavy_hitters.top(top)
+    stats["distinct_ips"] = distinct.count()
+    return stats
+
+
+_worker_client = None
+
+
+def _connect(uri):
+    """opens the MongoClient of a worker process"""
+    global _worker_client
+    _worker_client = MongoClient(uri)
+
+
+def _scan_range(database, collection, low, high):
+    """counts the logs whose _id is in [low, high), either bound being
+    optional, and returns the totals and the count of each IP"""
+    logs_collection = _worker_client[database][collection]
+    match = {}
+    if low is not None:
+        match["$gte"] = low
+    if high is not None:
+        match["$lt"] = high
+    pipeline = [count_stage("$ip")]
+    if match:
+        pipeline.insert(0, {"$match": {"_id": match}})
+    totals = Counter()
+    ip_counts = {}
+    for group in logs_collection.aggregate(pipeline, allowDiskUse=True):
+        ip = group.pop("_id")
+        totals.update(group)
+        ip_counts[ip] = group["total"]
+    return totals, ip_counts
+
+
+def _split_ids(logs_collection, ranges, samples=100):
+    """returns the bounds that split the _id values into about equal
+    ranges, taken from a random sample of samples _id per range"""
+    ids = sorted(
+        doc["_id"] for doc in logs_collection.aggregate([
+            {"$sample": {"size": ranges * samples}},
+            {"$project": {"_id": 1}},
+        ]))
+    bounds = sorted(set(ids[i] for i in range(samples, len(ids), samples)))
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def parallel_log_stats(uri="mongodb://127.0.0.1:27017", database="logs",
+                       collection="nginx", workers=None, top=10):
+    """computes the stats of log_stats with workers processes, each with
+    its own MongoClient, that aggregate _id ranges of the collection at
+    the same time; there are four ranges per worker, so a slow range
+    does not leave the other workers idle"""
+    workers = workers or os.cpu_count()
+    with MongoClient(uri) as client:
+        ranges = _split_ids(client[database][collection], workers * 4)
+    totals = Counter()
+    ip_counts = Counter()
+    with ProcessPoolExecutor(workers, initializer=_connect,
+                             initargs=(uri,)) as pool:
+        scans = [
+            pool.submit(_scan_range, database, collection, low, high)
+            for low, high in ranges
+        ]
+        for scan in scans:
+            range_totals, range_ips = scan.result()
+            totals.update(range_totals)
+            ip_counts.update(range_ips)
+    stats = {key: totals[key] for key in ("total", "status", *METHODS)}
+    stats["ips"] = ip_counts.most_common(top)
+    return stats
+
+
+def _apply_ip_counts(ip_collection, ip_counts, applied):
+    """adds the IP counts of a run to the running totals; an IP already
+    marked with the run's high-water mark was added by an interrupted
+    attempt of the same run and is skipped, so retrying is safe"""
+    requests = [
+        UpdateOne(
+            {"_id": ip, "applied": {"$ne": applied}},
+            {"$inc": {"count": count}, "$set": {"applied": applied}},
+            upsert=True)
+        for ip, count in ip_counts
+    ]
+    for start in range(0, len(requests), 1000):
+        try:
+            ip_collection.bulk_write(
+                requests[start:start + 1000], ordered=False)
+        except BulkWriteError as exc:
+            errors = exc.details["writeErrors"]
+            if any(error["code"] != 11000 for error in errors):
+                raise
+
+
+def incremental_log_stats(logs_collection, top=10, settle=5):
+    """computes the stats of log_stats from the running totals kept in
+    <collection>_stats and <collection>_stats_ips, after adding to them
+    the logs added since the last run, found by their ObjectId
+
+    Only logs at least settle seconds old are read, since a log whose
+    _id was generated just before another's may be inserted after it.
+    A run first records the _id it reads up to, and retries that same
+    range if it was interrupted, so no log is counted twice."""
+    database = logs_collection.database
+    stats_collection = database[f"{logs_collection.name}_stats"]
+    ip_collection = database[f"{logs_collection.name}_stats_ips"]
+    ip_collection.create_index([("count", -1)])
+    checkpoint = stats_collection.find_one({"_id": "checkpoint"}) or {}
+    low, high = checkpoint.get("hwm"), checkpoint.get("pending")
+    if high is None:
+        high = ObjectId.from_datetime(
+            datetime.now(timezone.utc) - timedelta(seconds=settle))
+        if low is not None and high <= low:
+            high = low
+        stats_collection.update_one(
+            {"_id": "checkpoint"}, {"$set": {"pending": high}}, upsert=True)
+    match = {"$lt": high} if low is None else {"$gte": low, "$lt": high}
+    totals = {"total": 0, "status": 0, **dict.fromkeys(METHODS, 0)}
+    ip_counts = []
+    for group in logs_collection.aggregate(
+            [{"$match": {"_id": match}}, count_stage("$ip")],
+            allowDiskUse=True):
+        for key in totals:
+            totals[key] += group[key]
+        ip_counts.append((group["_id"], group["total"]))
+    _apply_ip_counts(ip_collection, ip_counts, high)
+    stats_collection.update_one(
+        {"_id": "checkpoint", "pending": high},
+        {"$inc": totals, "$set": {"hwm": high}, "$unset": {"pending": ""}})
+    checkpoint = stats_collection.find_one({"_id": "checkpoint"})
+    stats = {key: checkpoint.get(key, 0) for key in totals}
+    stats["ips"] = [
+        (ip["_id"], ip["count"])
+        for ip in ip_collection.find().sort("count", -1).limit(top)
+    ]
+    return stats
+
+
+def print_report(stats):
+    """prints the stats computed by log_stats"""
+    print(f"{stats['total']} logs")
     print("Methods:")
-    for method in methods:
-        numOfLogs = logs_collection.count_documents({"method": method})
-        print(f"\tmethod {method}: {numOfLogs}")
-    statusMehtod = logs_collection.count_documents(
-        {"method": "GET", "path": "/status"}
-        )
-    print(f"{statusMehtod} status check")
+    for method in METHODS:
+        print(f"\tmethod {method}: {stats[method]}")
+    print(f"{stats['status']} status check")
     print("IPs:")
-    ip_pipeline = [
-        {"$group": {"_id": "$ip", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10},
-    ]
+    for ip, count in stats["ips"]:
+        print(f"\t{ip}: {count}")
+    if "distinct_ips" in stats:
+        print(f"~{stats['distinct_ips']} distinct IPs")
 
-    top_ips = logs_collection.aggregate(ip_pipeline)
 
-    for ip in top_ips:
-        print(f"\t{ip['_id']}: {ip['count']}")
+if __name__ == "__main__":
+    """main script"""
+    client = MongoClient("mongodb://127.0.0.1:27017")
+    if "--incremental" in sys.argv[1:]:
+        print_report(incremental_log_stats(client.logs.nginx))
+    elif "--approximate" in sys.argv[1:]:
+        print_report(approximate_log_stats(client.logs.nginx))
+    elif "--parallel" in sys.argv[1:]:
+        print_report(parallel_log_stats())
+    else:
+        print_report(log_stats(client.logs.nginx))
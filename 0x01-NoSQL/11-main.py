@@ -2,7 +2,7 @@
 """ 11-main """
 from pymongo import MongoClient
 list_all = __import__('8-all').list_all
-insert_school = __import__('9-insert_school').insert_school
+insert_schools = __import__('9-insert_school').insert_schools
 schools_by_topic = __import__('11-schools_by_topic').schools_by_topic
 
 if __name__ == "__main__":
@@ -16,8 +16,7 @@ if __name__ == "__main__":
         { 'name': "UCSD", 'topics': ["Cassandra"]},
         { 'name': "Stanford", 'topics': ["C", "React", "Javascript"]}
     ]
-    for j_school in j_schools:
-        insert_school(school_collection, **j_school)
+    insert_schools(school_collection, j_schools)
 
     schools = schools_by_topic(school_collection, "Python")
     for school in schools:
@@ -2,20 +2,37 @@
 """script that provides some stats about Nginx logs stored in MongoDB"""
 from pymongo import MongoClient
 
+METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE"]
+
+
+def count_stage(group_by=None):
+    """builds a $group stage that counts the logs, the logs of each
+    method and the status checks in a single pass over the collection,
+    or per value of the group_by expression, such as "$ip" for IPs"""
+    counts = {
+        "_id": group_by,
+        "total": {"$sum": 1},
+        "status": {"$sum": {"$cond": [
+            {"$and": [
+                {"$eq": ["$method", "GET"]},
+                {"$eq": ["$path", "/status"]},
+            ]}, 1, 0]}},
+    }
+    for method in METHODS:
+        counts[method] = {
+            "$sum": {"$cond": [{"$eq": ["$method", method]}, 1, 0]}}
+    return {"$group": counts}
+
 
 if __name__ == "__main__":
     """main script"""
     client = MongoClient('mongodb://127.0.0.1:27017')
     logs_collection = client.logs.nginx
-    methods = ["GET", "POST", "PUT", "PATCH", "DELETE"]
-    all_logs = logs_collection.count_documents({})
-    print(f"{all_logs} logs")
+    stats = next(logs_collection.aggregate([count_stage()]), {})
+    print(f"{stats.get('total', 0)} logs")
     print("Methods:")
-    for method in methods:
-        numOfLogs = logs_collection.count_documents({"method": method})
-        print(f"\tmethod {method}: {numOfLogs}")
-    statusMehtod = logs_collection.count_documents(
-        {"method": "GET", "path": "/status"})
+    for method in METHODS:
+        print(f"\tmethod {method}: {stats.get(method, 0)}")
     print(
-        f"{statusMehtod} status check"
+        f"{stats.get('status', 0)} status check"
         )
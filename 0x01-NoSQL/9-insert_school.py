@@ -2,6 +2,10 @@
 """
 function that inserts a new document in a collection based on kwargs
 """
+import sys
+from itertools import islice
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError, PyMongoError
 
 
 def insert_school(mongo_collection, **kwargs):
@@ -9,3 +13,47 @@ def insert_school(mongo_collection, **kwargs):
     status = mongo_collection.insert_one(kwargs)
     if status.acknowledged:
         return status.inserted_id
+
+
+def _print_error(batch, error):
+    """default error handler of insert_schools"""
+    print(f"batch {batch}: {error}", file=sys.stderr)
+
+
+def insert_schools(mongo_collection, docs, batch_size=1000, ordered=False,
+                   write_concern=None, on_error=_print_error):
+    """inserts the documents of any iterable with one insert_many per
+    batch of batch_size, and returns the list of the _id of each
+    inserted document once every batch is written
+
+    write_concern is a WriteConcern or a dict such as {"w": 1}; with
+    {"w": 0} the batches are not acknowledged and their ids are listed
+    without waiting. A batch that fails, fully or for some documents,
+    is passed with its number, counted from 0, to on_error, and the
+    load goes on with the next batch; only the ids of the documents
+    actually inserted are listed"""
+    if isinstance(write_concern, dict):
+        write_concern = WriteConcern(**write_concern)
+    if write_concern is not None:
+        mongo_collection = mongo_collection.with_options(
+            write_concern=write_concern)
+    docs = iter(docs)
+    ids = []
+    number = 0
+    while True:
+        batch = list(islice(docs, batch_size))
+        if not batch:
+            return ids
+        try:
+            ids.extend(mongo_collection.insert_many(
+                batch, ordered=ordered).inserted_ids)
+        except BulkWriteError as exc:
+            failed = {error["index"] for error in exc.details["writeErrors"]}
+            if ordered and failed:
+                failed = range(min(failed), len(batch))
+            ids.extend(doc["_id"] for i, doc in enumerate(batch)
+                       if i not in failed)
+            on_error(number, exc)
+        except PyMongoError as exc:
+            on_error(number, exc)
+        number += 1
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""fixed-memory sketches for counting the IPs of a stream of logs"""
+import hashlib
+import heapq
+import itertools
+import math
+
+
+class SpaceSaving:
+    """estimates the most frequent items of a stream with
+    ceil(1 / error) counters: the count of every item is overestimated
+    by at most error times the number of items seen, and every item
+    seen more often than that is kept"""
+
+    def __init__(self, error=0.001):
+        """creates an empty sketch with the given relative error"""
+        self.capacity = math.ceil(1 / error)
+        self.seen = 0
+        self._counts = {}
+        self._heap = []
+        self._order = itertools.count()
+
+    def add(self, item, count=1):
+        """counts an item; when all counters are taken, the item
+        replaces the least counted one and inherits its count;
+        items of any type can be mixed, since ties in the heap are
+        broken by insertion order instead of by comparing items"""
+        self.seen += count
+        if item in self._counts:
+            self._counts[item] += count
+        elif len(self._counts) < self.capacity:
+            self._counts[item] = count
+        else:
+            while True:
+                least, _, victim = heapq.heappop(self._heap)
+                if self._counts.get(victim) == least:
+                    break
+            del self._counts[victim]
+            self._counts[item] = least + count
+        heapq.heappush(
+            self._heap, (self._counts[item], next(self._order), item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, next(self._order), i)
+                          for i, c in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, k):
+        """returns the k items with the highest estimated counts,
+        as (item, count) pairs, most frequent first"""
+        return heapq.nlargest(
+            k, self._counts.items(), key=lambda pair: pair[1])
+
+
+class HyperLogLog:
+    """estimates the number of distinct items of a stream in
+    2 ** precision bytes, with a standard error of about
+    1.04 / sqrt(2 ** precision)"""
+
+    def __init__(self, error=0.01):
+        """creates an empty sketch with the given standard error"""
+        self.precision = min(18, max(4, math.ceil(
+            math.log2((1.04 / error) ** 2))))
+        self._registers = bytearray(1 << self.precision)
+
+    def add(self, item):
+        """counts an item, hashing its string form"""
+        digest = hashlib.blake2b(
+            str(item).encode(), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        index = value >> (64 - self.precision)
+        rest = value & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def count(self):
+        """returns the estimated number of distinct items"""
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(
+            2.0 ** -register for register in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""unit tests for the log stats modes of 102-log_stats and the
+batched inserts of 9-insert_school, run against an in-memory
+mongomock server"""
+import random
+import struct
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import mongomock
+import mongomock.collection
+from bson import ObjectId
+from log_sketches import SpaceSaving
+log_stats_module = __import__('102-log_stats')
+insert_schools = __import__('9-insert_school').insert_schools
+
+_add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+
+def add_update(self, *args, sort=None, **kwargs):
+    """drops the sort option pymongo passes with UpdateOne,
+    which mongomock does not know"""
+    return _add_update(self, *args, **kwargs)
+
+
+def seed(collection, count, age, rng):
+    """inserts count logs whose _id is age seconds old"""
+    collection.insert_many([{
+        "_id": ObjectId(
+            struct.pack(">I", int(time.time() - age)) + rng.randbytes(8)),
+        "ip": f"10.0.0.{rng.randint(1, 20)}",
+        "method": rng.choice(["GET", "POST", "PUT", "PATCH", "DELETE"]),
+        "path": rng.choice(["/status", "/"]),
+    } for _ in range(count)])
+
+
+class TestLogStats(unittest.TestCase):
+    """
+    Unit tests for the incremental, approximate and parallel modes.
+    """
+
+    def setUp(self):
+        """
+        Set up a log collection on a fresh mongomock server.
+        """
+        self.client = mongomock.MongoClient()
+        self.logs = self.client.logs.nginx
+        self.rng = random.Random(1)
+        patcher = patch.object(
+            mongomock.collection.BulkOperationBuilder, "add_update",
+            add_update)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertSameStats(self, stats, expected):
+        """
+        Assert that two stats agree, whatever the order of tied IPs.
+        """
+        self.assertEqual(dict(stats["ips"]), dict(expected["ips"]))
+        self.assertEqual({k: v for k, v in stats.items() if k != "ips"},
+                         {k: v for k, v in expected.items() if k != "ips"})
+
+    def test_incremental_matches_full_scan(self):
+        """
+        Test that two increments add up to the stats of a full scan.
+        """
+        seed(self.logs, 300, 200, self.rng)
+        stats = log_stats_module.incremental_log_stats(
+            self.logs, top=20, settle=100)
+        self.assertSameStats(stats, log_stats_module.log_stats(self.logs, 20))
+        seed(self.logs, 200, 50, self.rng)
+        stats = log_stats_module.incremental_log_stats(
+            self.logs, top=20, settle=10)
+        self.assertSameStats(stats, log_stats_module.log_stats(self.logs, 20))
+
+    def test_interrupted_run_is_not_counted_twice(self):
+        """
+        Test that a run interrupted after the IP counts were added
+        is retried without counting its logs twice.
+        """
+        seed(self.logs, 300, 200, self.rng)
+        apply_ip_counts = log_stats_module._apply_ip_counts
+
+        def interrupted(*args):
+            apply_ip_counts(*args)
+            raise ConnectionError()
+
+        with patch.object(log_stats_module, "_apply_ip_counts",
+                          side_effect=interrupted):
+            with self.assertRaises(ConnectionError):
+                log_stats_module.incremental_log_stats(self.logs, top=20)
+        stats = log_stats_module.incremental_log_stats(self.logs, top=20)
+        self.assertSameStats(stats, log_stats_module.log_stats(self.logs, 20))
+
+    def test_approximate_is_exact_with_few_ips(self):
+        """
+        Test that the sketches are exact while every IP has a counter,
+        including the logs without an IP.
+        """
+        seed(self.logs, 300, 0, self.rng)
+        self.logs.insert_many([{"method": "GET"} for _ in range(5)])
+        stats = log_stats_module.approximate_log_stats(self.logs, top=30)
+        self.assertEqual(stats.pop("distinct_ips"), 21)
+        self.assertSameStats(stats, log_stats_module.log_stats(self.logs, 30))
+
+    def test_space_saving_mixes_item_types(self):
+        """
+        Test that tied counts of items that cannot be compared,
+        such as None and strings, do not break the sketch.
+        """
+        sketch = SpaceSaving(error=0.5)
+        for item in ["a", None, "b", None, "c", "a", None]:
+            sketch.add(item)
+        self.assertEqual(sketch.top(1), [(None, 4)])
+        self.assertEqual(sketch.seen, 7)
+
+    def test_parallel_matches_full_scan(self):
+        """
+        Test that the _id ranges cover every log exactly once.
+        """
+        seed(self.logs, 500, 0, self.rng)
+        split_ids = log_stats_module._split_ids
+        ranges = []
+
+        def recorded(*args):
+            ranges.extend(split_ids(*args))
+            return ranges
+
+        with patch.object(log_stats_module, "MongoClient",
+                          return_value=self.client), \
+                patch.object(log_stats_module, "ProcessPoolExecutor",
+                             ThreadPoolExecutor), \
+                patch.object(log_stats_module, "_split_ids", recorded):
+            stats = log_stats_module.parallel_log_stats(workers=1, top=20)
+        self.assertEqual(len(ranges), 4)
+        self.assertSameStats(stats, log_stats_module.log_stats(self.logs, 20))
+
+    def test_parallel_closes_parent_client(self):
+        """
+        Test that the client used to split the _ids is closed
+        before the worker processes are forked.
+        """
+        seed(self.logs, 50, 0, self.rng)
+
+        def executor(*args, **kwargs):
+            close.assert_called_once()
+            return ThreadPoolExecutor(*args, **kwargs)
+
+        with patch.object(log_stats_module, "MongoClient",
+                          return_value=self.client), \
+                patch.object(self.client, "close") as close, \
+                patch.object(log_stats_module, "ProcessPoolExecutor",
+                             executor):
+            log_stats_module.parallel_log_stats(workers=1, top=20)
+        close.assert_called_once()
+
+    def test_split_ids(self):
+        """
+        Test that the ranges are contiguous and open at both ends.
+        """
+        seed(self.logs, 500, 0, self.rng)
+        ranges = log_stats_module._split_ids(self.logs, 4, samples=10)
+        self.assertIsNone(ranges[0][0])
+        self.assertIsNone(ranges[-1][1])
+        for (_, high), (low, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(high, low)
+
+
+class TestInsertSchools(unittest.TestCase):
+    """
+    Unit tests for the batched inserts of insert_schools.
+    """
+
+    def setUp(self):
+        """
+        Set up a collection already holding the _ids 1 and 4.
+        """
+        self.schools = mongomock.MongoClient().my_db.school
+        self.schools.insert_many([{"_id": 1}, {"_id": 4}])
+        self.errors = []
+
+    def insert(self, ordered):
+        """
+        Insert the _ids 0 to 6 in batches of 3, recording the
+        numbers of the batches that failed.
+        """
+        return insert_schools(
+            self.schools, [{"_id": i} for i in range(7)], batch_size=3,
+            ordered=ordered,
+            on_error=lambda number, exc: self.errors.append(number))
+
+    def test_inserts_without_reading_ids(self):
+        """
+        Test that the documents are inserted when the call returns.
+        """
+        insert_schools(self.schools, [{"name": "UCSF"}, {"name": "UCLA"}])
+        self.assertEqual(self.schools.count_documents({}), 4)
+
+    def test_unordered_duplicates(self):
+        """
+        Test that an unordered batch skips only its duplicate _ids.
+        """
+        self.assertEqual(self.insert(ordered=False), [0, 2, 3, 5, 6])
+        self.assertEqual(self.errors, [0, 1])
+        self.assertEqual(self.schools.count_documents({}), 7)
+
+    def test_ordered_duplicates(self):
+        """
+        Test that an ordered batch stops at its first duplicate _id,
+        so the documents after it are neither inserted nor listed.
+        """
+        self.assertEqual(self.insert(ordered=True), [0, 3, 6])
+        self.assertEqual(self.errors, [0, 1])
+        self.assertEqual(
+            sorted(doc["_id"] for doc in self.schools.find()),
+            [0, 1, 3, 4, 6])
+
+
+if __name__ == "__main__":
+    unittest.main()
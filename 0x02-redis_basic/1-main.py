@@ -5,7 +5,7 @@ Main file
 import redis
 from exercise import Cache
 
-cache = Cache()
+cache = Cache(flush=True)
 
 data = 2
 key = cache.store(data)
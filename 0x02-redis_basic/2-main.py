@@ -1,4 +1,4 @@
-cache = Cache()
+cache = Cache(flush=True)
 
 TEST_CASES = {
     b"foo": None,
@@ -1,7 +1,7 @@
 
 Cache = __import__('exercise').Cache
 
-cache = Cache()
+cache = Cache(flush=True)
 
 cache.store(b"first")
 print(cache.get(cache.store.__qualname__))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""A module for using the Redis NoSQL data storage from asyncio.
+This module provides an AsyncCache class with the same interface
+as exercise.Cache, backed by redis.asyncio so that callers on an
+event loop never block on a Redis round trip. The AsyncCache
+instances on one event loop share one connection pool.
+"""
+import asyncio
+import uuid
+import weakref
+import redis
+import redis.asyncio
+from functools import wraps
+from typing import Any, Callable, Union
+from exercise import _to_str
+
+_pools = weakref.WeakKeyDictionary()
+
+
+def shared_pool() -> redis.asyncio.BlockingConnectionPool:
+    """Returns the connection pool shared by every AsyncCache
+    on the running event loop. The connections of a pool belong to
+    the loop that opened them, so each loop, such as each
+    asyncio.run, gets a pool of its own. The pool is blocking, so
+    thousands of concurrent coroutines wait for one of its
+    connections instead of opening a socket each.
+
+    Returns:
+        redis.asyncio.BlockingConnectionPool: The shared pool.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = redis.asyncio.BlockingConnectionPool(
+            max_connections=64)
+    return pool
+
+
+def count_calls(method: Callable) -> Callable:
+    """Tracks the number of calls
+    made to a coroutine method in an AsyncCache class.
+    Increments a Redis key that
+    corresponds to the method's qualified name.
+
+    Args:
+        method (Callable): The coroutine method to be decorated.
+
+    Returns:
+        Callable: The wrapped coroutine method
+        that increments the call count.
+    """
+
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs) -> Any:
+        """Awaits the given method after
+        incrementing its call counter."""
+        if isinstance(self._redis, redis.asyncio.Redis):
+            await self._redis.incr(method.__qualname__)
+        return await method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def call_history(method: Callable) -> Callable:
+    """Tracks the call history
+    of a coroutine method in an AsyncCache class.
+    Stores the inputs and outputs of the method calls.
+
+    Args:
+        method (Callable): The coroutine method to be decorated.
+
+    Returns:
+        Callable: The wrapped coroutine
+        method that tracks input and output history.
+    """
+
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs) -> Any:
+        key_input = f"{method.__qualname__}:inputs"
+        key_output = f"{method.__qualname__}:outputs"
+        if isinstance(self._redis, redis.asyncio.Redis):
+            await self._redis.rpush(key_input, str(args))
+        data = await method(self, *args, **kwargs)
+        if isinstance(self._redis, redis.asyncio.Redis):
+            await self._redis.rpush(key_output, data)
+        return data
+
+    return wrapper
+
+
+async def replay(fn: Callable) -> None:
+    """Displays the call history of an AsyncCache class method"""
+    if fn is None or not hasattr(fn, "__self__"):
+        return
+
+    redius = getattr(fn.__self__, "_redis", None)
+    if not isinstance(redius, redis.asyncio.Redis):
+        return
+
+    method_name = fn.__qualname__
+    in_key = f"{method_name}:inputs"
+    out_key = f"{method_name}:outputs"
+    num_of_calls = int(await redius.get(method_name) or 0)
+
+    print(f"{method_name} was called {num_of_calls} times:")
+
+    inputs = await redius.lrange(in_key, 0, -1)
+    outputs = await redius.lrange(out_key, 0, -1)
+
+    for ins, outs in zip(inputs, outputs):
+        print(
+            f'{method_name}(*{ins.decode("utf-8")}) -> {outs.decode("utf-8")}'
+            )
+
+
+class AsyncCache:
+    """Represents an object
+    for storing data in a Redis data storage from asyncio code.
+
+    Methods:
+        store(data: Union[str, bytes, int, float]) -> str:
+            Stores data in the Redis
+            cache and returns a unique key.
+
+        get(key: str, fn: Optional[Callable] = None) ->
+        Union[str, bytes, int, float, None]:
+            Retrieves data from the Redis
+            cache using the provided key.
+            Optionally applies a conversion
+            function to the data.
+
+        get_str(key: str) -> Optional[str]:
+            Retrieves the data as a UTF-8 decoded string.
+
+        get_int(key: str) -> Optional[int]:
+            Retrieves the data as an integer.
+
+    Every method is a coroutine and must be awaited.
+    """
+
+    def __init__(
+        self,
+        client: redis.asyncio.Redis = None,
+        connection_pool: redis.asyncio.ConnectionPool = None,
+    ) -> None:
+        """Initializes an AsyncCache instance.
+        Unlike Cache, the database is not flushed, since that
+        would need a round trip; await flush() to empty it.
+
+        Args:
+            client (redis.asyncio.Redis): The client to use,
+            instead of one on the shared pool of the running loop.
+            connection_pool (redis.asyncio.ConnectionPool): The pool
+            to use, instead of the shared pool of the running loop.
+        """
+        if client is None and connection_pool is not None:
+            client = redis.asyncio.Redis(connection_pool=connection_pool)
+        self._client = client
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def _redis(self) -> redis.asyncio.Redis:
+        """The client of the AsyncCache on the running event loop."""
+        if self._client is not None:
+            return self._client
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.asyncio.Redis(
+                connection_pool=shared_pool())
+        return client
+
+    async def flush(self) -> None:
+        """Empties the Redis database."""
+        await self._redis.flushdb(True)
+
+    @count_calls
+    @call_history
+    async def store(self, data: Union[str, bytes, int, float]) -> str:
+        """Stores a value in a Redis data
+        storage and returns the key.
+
+        Args:
+            data (Union[str, bytes, int, float]):
+                The data to store in Redis.
+                Can be a string, bytes, int, or float.
+
+        Returns:
+            str: A unique key generated
+            for the stored data.
+        """
+        data_key = str(uuid.uuid4())
+        await self._redis.set(data_key, data)
+        return data_key
+
+    async def get(
+        self,
+        key: str,
+        fn: Callable = None,
+    ) -> Union[str, bytes, int, float]:
+        """Retrieves a value from a Redis data storage.
+
+        Args:
+            key (str): The Redis key for the data.
+            fn (Optional[Callable]): A function to apply
+            to the retrieved data for conversion.
+
+        Returns:
+            Union[str, bytes, int, float]:
+            The retrieved data, optionally converted
+            by the provided function,
+            or None if the key doesn't exist.
+        """
+        data = await self._redis.get(key)
+        return fn(data) if fn is not None else data
+
+    async def get_str(self, key: str) -> str:
+        """Retrieves a string value from a Redis data storage.
+
+        Args:
+            key (str): The Redis key for the data.
+
+        Returns:
+            str: The retrieved data decoded as a string,
+            or None if the key doesn't exist.
+        """
+        return await self.get(key, _to_str)
+
+    async def get_int(self, key: str) -> int:
+        """Retrieves an integer value from a Redis data storage.
+
+        Args:
+            key (str): The Redis key for the data.
+
+        Returns:
+            int: The retrieved data converted to an integer,
+            or None if the key doesn't exist.
+        """
+        return await self.get(key, lambda x: int(x))
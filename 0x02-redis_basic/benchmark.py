@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Benchmarks for the Cache class in exercise.py.
+Counts the Redis round trips an instrumented Cache.store makes,
+with and without pipelined instrumentation or the store script,
+compares the speed and size of the value codecs, and counts the
+connections opened when a Cache is made per request.
+
+The suite benchmark times Cache.store, get, get_str, get_int,
+the overhead of the instrumentation decorators and replay over
+histories of several sizes. It reports operations per second,
+latency percentiles and memory per key, and can save them as a
+baseline and compare later runs against it. With --fake it runs
+on an in-process fakeredis server instead of a local redis-server.
+
+Usage: ./benchmark.py [round_trips] [codecs] [connections] [suite]
+       [--url URL | --fake] [--save FILE] [--compare FILE]
+       [--tolerance FRACTION]
+"""
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import math
+import sys
+import time
+import timeit
+import uuid
+import redis
+from exercise import Cache, replay
+from serialization import CODECS, get_codec
+from typing import Callable, Dict, List
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class CountingConnection(redis.Connection):
+    """A Redis connection that counts the round trips it makes,
+    and how many times a socket is opened.
+    Every command, or every batch of pipelined commands,
+    is written to the socket with a single send_packed_command.
+    """
+
+    round_trips = 0
+    connects = 0
+
+    def send_packed_command(self, *args, **kwargs) -> None:
+        """Counts the round trip and sends the packed command."""
+        CountingConnection.round_trips += 1
+        super().send_packed_command(*args, **kwargs)
+
+    def on_connect(self) -> None:
+        """Counts the new socket and sets up the connection."""
+        CountingConnection.connects += 1
+        super().on_connect()
+
+
+def round_trips_per_call(cache: Cache, calls: int = 1000) -> float:
+    """Measures the average number of round trips per Cache.store.
+
+    Args:
+        cache (Cache): The cache to benchmark, on a pool of
+        CountingConnection.
+        calls (int): The number of values to store.
+
+    Returns:
+        float: The round trips made per store call.
+    """
+    cache.store("warm-up")
+    CountingConnection.round_trips = 0
+    for i in range(calls):
+        cache.store(i)
+    return CountingConnection.round_trips / calls
+
+
+def round_trips() -> None:
+    """Prints the round trips per store with and without pipelining,
+    and with the store script.
+    """
+    pool = redis.ConnectionPool(connection_class=CountingConnection)
+    for option, enabled in (("pipelined", False), ("pipelined", True),
+                            ("scripted", True)):
+        cache = Cache(connection_pool=pool, flush=True, **{option: enabled})
+        print(
+            f"{option}={enabled}: "
+            f"{round_trips_per_call(cache):.2f} round trips per store"
+            )
+
+
+SAMPLES = {
+    "int": 1234567890,
+    "float": 3.141592653589793,
+    "str": "hello world " * 4,
+    "record": {
+        "name": "Holberton school",
+        "topics": ["Algo", "C", "Python", "React"],
+        "scores": [12.5, 18.0, 9.75],
+        "open": True,
+    },
+    "large str": "GET /status 200 127.0.0.1\n" * 2000,
+}
+
+
+def codecs(number: int = 2000) -> None:
+    """Prints the encode and decode time and the stored size
+    of sample values for every codec, with and without compression.
+    Values a codec cannot encode are skipped.
+    """
+    print(f"{'codec':<16}{'value':<12}{'bytes':>8}"
+          f"{'encode us':>12}{'decode us':>12}")
+    for name in CODECS:
+        for threshold in (None, 256):
+            codec = get_codec(name, threshold)
+            label = name if threshold is None else f"{name}+zlib"
+            for kind, value in SAMPLES.items():
+                try:
+                    payload = codec.encode(value)
+                except TypeError:
+                    continue
+                encode = timeit.timeit(
+                    lambda: codec.encode(value), number=number)
+                decode = timeit.timeit(
+                    lambda: codec.decode(payload), number=number)
+                print(f"{label:<16}{kind:<12}{len(payload):>8}"
+                      f"{encode * 1e6 / number:>12.2f}"
+                      f"{decode * 1e6 / number:>12.2f}")
+
+
+def connections(requests: int = 1000) -> None:
+    """Prints the sockets opened and the time taken to serve
+    requests that each make a Cache and read one key, with the
+    shared pool and with a new pool per Cache, as Cache used to.
+    """
+    shared = redis.ConnectionPool(connection_class=CountingConnection)
+    setups = {
+        "shared pool": lambda: Cache(connection_pool=shared),
+        "pool per Cache": lambda: Cache(connection_pool=redis.ConnectionPool(
+            connection_class=CountingConnection)),
+    }
+    for label, make_cache in setups.items():
+        CountingConnection.connects = 0
+        elapsed = timeit.timeit(
+            lambda: make_cache().get("missing"), number=requests)
+        print(f"{label}: {CountingConnection.connects} connections, "
+              f"{elapsed * 1e6 / requests:.1f} us per request")
+
+
+def percentile(latencies: List[float], q: float) -> float:
+    """Returns the q-th percentile of sorted latencies."""
+    return latencies[max(0, math.ceil(q / 100 * len(latencies)) - 1)]
+
+
+def measure(operation: Callable, number: int) -> Dict[str, float]:
+    """Times number calls of operation, one at a time.
+
+    Returns:
+        Dict[str, float]: The operations per second and the
+        50th, 95th and 99th percentile latencies in microseconds.
+    """
+    operation()
+    latencies = []
+    for _ in range(number):
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "ops_per_sec": number / sum(latencies),
+        **{
+            f"p{q}_us": percentile(latencies, q) * 1e6
+            for q in (50, 95, 99)
+        },
+    }
+
+
+def memory_per_key(client: redis.Redis, keys: List[str]) -> float:
+    """Returns the mean MEMORY USAGE of keys in bytes,
+    or None if the server does not support the command.
+    """
+    try:
+        sizes = [client.memory_usage(key, samples=0) for key in keys]
+    except redis.ResponseError:
+        return None
+    return sum(sizes) / len(sizes)
+
+
+def run_suite(
+    client: redis.Redis,
+    number: int = 2000,
+    history_sizes: tuple = (100, 1000, 10000),
+) -> Dict[str, Dict[str, float]]:
+    """Runs every case of the suite on client.
+    The keys are written under a random namespace,
+    which is deleted afterwards.
+
+    Returns:
+        Dict[str, Dict[str, float]]: The measures of each case.
+    """
+    namespace = f"benchmark:{uuid.uuid4().hex}"
+    cache = Cache(client=client, namespace=namespace)
+    store = inspect.unwrap(Cache.store)
+    value = "hello world " * 4
+    keys = []
+    results = {
+        "store": measure(lambda: keys.append(cache.store(value)), number),
+        "store undecorated": measure(lambda: store(cache, value), number),
+    }
+    key = keys[0]
+    number_key = cache.store(1234567890)
+    results["get"] = measure(lambda: cache.get(key), number)
+    results["get_str"] = measure(lambda: cache.get_str(key), number)
+    results["get_int"] = measure(lambda: cache.get_int(number_key), number)
+    results["store"]["bytes_per_key"] = memory_per_key(
+        client, [f"{namespace}:{key}" for key in keys[:100]])
+    for size in history_sizes:
+        history = Cache(client=client, namespace=f"{namespace}:{size}")
+        history.store_many(range(size))
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[f"replay {size}"] = measure(
+                lambda: replay(history.store), max(5, number * 10 // size))
+    for key in client.scan_iter(f"{namespace}:*", count=1000):
+        client.delete(key)
+    return results
+
+
+def report(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]] = None,
+    tolerance: float = 0.2,
+) -> List[str]:
+    """Prints the results, next to the baseline if any.
+
+    Args:
+        results (Dict[str, Dict[str, float]]): The measures of a run.
+        baseline (Dict[str, Dict[str, float]]): Saved measures to
+        compare them with.
+        tolerance (float): The fraction of the baseline operations
+        per second a case may lose before it is a regression.
+
+    Returns:
+        List[str]: The cases that regressed.
+    """
+    regressions = []
+    print(f"{'case':<20}{'ops/s':>10}{'p50 us':>10}{'p95 us':>10}"
+          f"{'p99 us':>10}{'B/key':>8}{'vs base':>10}")
+    for case, result in results.items():
+        size = result.get("bytes_per_key")
+        line = (f"{case:<20}{result['ops_per_sec']:>10.0f}"
+                f"{result['p50_us']:>10.1f}{result['p95_us']:>10.1f}"
+                f"{result['p99_us']:>10.1f}"
+                f"{'' if size is None else f'{size:.0f}':>8}")
+        if baseline and case in baseline:
+            ratio = result["ops_per_sec"] / baseline[case]["ops_per_sec"]
+            line += f"{ratio - 1:>+10.0%}"
+            if ratio < 1 - tolerance:
+                line += "  REGRESSION"
+                regressions.append(case)
+        print(line)
+    overhead = (results["store"]["p50_us"]
+                - results["store undecorated"]["p50_us"])
+    print(f"decorator overhead: {overhead:.1f} us per store at p50")
+    return regressions
+
+
+def suite(
+    client: redis.Redis = None,
+    save: str = None,
+    compare: str = None,
+    tolerance: float = 0.2,
+) -> bool:
+    """Runs the suite and prints its report.
+
+    Args:
+        client (redis.Redis): The server to run on,
+        a local redis-server by default.
+        save (str): A file to save the results to, as a baseline.
+        compare (str): A baseline file to compare the results with.
+        tolerance (float): See report.
+
+    Returns:
+        bool: False if a case regressed from the baseline.
+    """
+    results = run_suite(client or redis.Redis())
+    baseline = None
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, tolerance)
+    if save:
+        with open(save, "w") as f:
+            json.dump(results, f, indent=2)
+    return not regressions
+
+
+BENCHMARKS = {
+    "round_trips": round_trips,
+    "codecs": codecs,
+    "connections": connections,
+    "suite": suite,
+}
+
+
+def main(argv: List[str] = None) -> int:
+    """Runs the benchmarks named on the command line, or all of them."""
+    parser = argparse.ArgumentParser(description="Cache benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help=f"one of {', '.join(BENCHMARKS)}")
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument("--url", help="the redis-server of the suite")
+    backend.add_argument("--fake", action="store_true",
+                         help="run the suite on an in-process fakeredis")
+    parser.add_argument("--save", help="save the suite results to FILE")
+    parser.add_argument("--compare",
+                        help="compare the suite results with FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="the ops/s a suite case may lose, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    client = None
+    if args.fake:
+        if fakeredis is None:
+            parser.error("--fake needs the fakeredis package")
+        client = fakeredis.FakeRedis()
+    elif args.url:
+        client = redis.Redis.from_url(args.url)
+    passed = True
+    for benchmark in args.benchmarks or BENCHMARKS:
+        if benchmark == "suite":
+            passed = suite(client, args.save, args.compare, args.tolerance)
+        else:
+            BENCHMARKS[benchmark]()
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,20 +2,267 @@
 """A module for using the Redis NoSQL data storage.
 This module provides a Cache class that interacts with a
 Redis database. It allows storing data in Redis and retrieving it
-with optional type conversions. The Redis database is flushed upon
-initialization of the Cache instance.
+with optional type conversions. Cache instances share one connection
+pool per process, so constructing one is cheap.
 """
+import os
+import math
+import hashlib
+import atexit
+import random
+import struct
+import time
 import uuid
+import threading
+import weakref
 import redis
+from bisect import bisect_left
+from serialization import get_codec
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import wraps
-from typing import Any, Callable, Union
+from itertools import islice
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+)
+
+_MISSING = object()
+_pool = None
+_MEMO_HEADER = struct.Struct("<dd")
+_CHUNK_SIZE = 1 << 20
+_caches = weakref.WeakSet()
+_forked = weakref.WeakSet()
+_histograms = weakref.WeakKeyDictionary()
+_histograms_lock = threading.Lock()
+_dirty = set()
+_dirty_lock = threading.Condition()
+_flusher = None
+_store_scripts = weakref.WeakKeyDictionary()
+_STORE_SCRIPT = """
+redis.call('INCR', KEYS[1])
+local maxlen = tonumber(ARGV[6])
+if ARGV[4] == '1' then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+if ARGV[3] == '' then
+    redis.call('SET', KEYS[3], ARGV[2])
+else
+    redis.call('SET', KEYS[3], ARGV[2], 'PX', ARGV[3])
+end
+if ARGV[4] == '1' then
+    redis.call('RPUSH', KEYS[4], ARGV[5])
+    if maxlen then
+        redis.call('LTRIM', KEYS[2], -maxlen, -1)
+        redis.call('LTRIM', KEYS[4], -maxlen, -1)
+    end
+end
+return 1
+"""
+
+
+def _new_keys(count: int) -> List[str]:
+    """Generates random UUID4 keys for a batch of values.
+    The random bytes for the whole batch are read at once
+    instead of once per key.
+
+    Args:
+        count (int): The number of keys to generate.
+
+    Returns:
+        List[str]: The generated keys.
+    """
+    raw = os.urandom(16 * count)
+    return [
+        str(uuid.UUID(bytes=raw[i:i + 16], version=4))
+        for i in range(0, 16 * count, 16)
+    ]
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    """Splits an iterable into lists of at most size items."""
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
+
+
+def _to_str(data: Any) -> str:
+    """Decodes Redis bytes as a UTF-8 string.
+    Values already decoded by a codec are converted with str.
+    """
+    if isinstance(data, bytes):
+        return data.decode("utf-8")
+    return data if data is None else str(data)
+
+
+_NEAR_CACHED = (None, int, _to_str)
+
+
+def shared_pool() -> redis.ConnectionPool:
+    """Returns the connection pool shared by every Cache
+    that is not given a client or a pool of its own.
+
+    Returns:
+        redis.ConnectionPool: The shared pool.
+    """
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool()
+    return _pool
+
+
+def _mark_dirty(obj: Any) -> None:
+    """Hands an object holding unsent data to the flusher thread,
+    which keeps it alive until the data is sent, so dropping the
+    Cache that owns it loses nothing. The thread is started on
+    demand and exits once no object holds unsent data, so idle
+    Caches cost no thread.
+
+    Args:
+        obj: An object with a flush_interval in seconds and a
+        _background_flush(force) method.
+    """
+    global _flusher
+    with _dirty_lock:
+        if obj not in _dirty:
+            _dirty.add(obj)
+            _dirty_lock.notify()
+        if _flusher is None:
+            _flusher = threading.Thread(target=_run_flusher, daemon=True)
+            _flusher.start()
+
+
+def _mark_clean(obj: Any) -> None:
+    """Tells the flusher thread an object has no unsent data left."""
+    with _dirty_lock:
+        _dirty.discard(obj)
+        if not _dirty:
+            _dirty_lock.notify()
+
+
+def _run_flusher() -> None:
+    """Lets every object holding unsent data flush what is due,
+    as often as the shortest flush interval among them.
+    """
+    global _flusher
+    while True:
+        with _dirty_lock:
+            if not _dirty:
+                _flusher = None
+                return
+            _dirty_lock.wait(min(obj.flush_interval for obj in _dirty))
+            dirty = list(_dirty)
+        for obj in dirty:
+            obj._background_flush(False)
+        del dirty
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    """Sends the unsent data of every object at process exit."""
+    with _dirty_lock:
+        dirty = list(_dirty)
+    for obj in dirty:
+        obj._background_flush(True)
+
+
+def _after_fork() -> None:
+    """Gives the connection pools in use a fresh copy in a forked child.
+    The sockets and locks of a pool are shared with the parent, and a
+    lock held by another parent thread at the fork is never released
+    in the child, so each pool is replaced by a new one with the same
+    settings rather than reset. Clients and Caches that shared a pool
+    share its replacement.
+    """
+    global _pool, _dirty, _dirty_lock, _flusher, _histograms_lock
+    _dirty, _dirty_lock, _flusher = set(), threading.Condition(), None
+    _histograms.clear()
+    _histograms_lock = threading.Lock()
+    for obj in list(_forked):
+        obj._after_fork()
+    pools = {}
+
+    def rebuilt(pool: redis.ConnectionPool) -> redis.ConnectionPool:
+        """Returns the replacement of a pool, made once."""
+        if id(pool) not in pools:
+            new = type(pool)(
+                connection_class=pool.connection_class,
+                max_connections=pool.max_connections,
+                **pool.connection_kwargs)
+            pools[id(pool)] = pools[id(new)] = new
+        return pools[id(pool)]
+
+    if _pool is not None:
+        _pool = rebuilt(_pool)
+    for cache in list(_caches):
+        cache._after_fork(rebuilt)
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _flush_batches(self) -> None:
+    """Sends the commands batched by every thread of a Cache."""
+    batcher = getattr(self, "_batcher", None)
+    if batcher is not None:
+        batcher.flush_all()
+
+
+def _prefixed(self, name: str) -> str:
+    """Returns a Redis key in the namespace of a Cache."""
+    return getattr(self, "_prefix", "") + name
+
+
+@contextmanager
+def _instrumented(self) -> Iterator[Any]:
+    """Yields the client that instrumented commands should go to.
+    When the Cache is pipelined, the first instrumented call opens a
+    pipeline that every nested decorator and the wrapped method queue
+    their commands on, and it is executed in one round trip once the
+    outermost call returns. An exception discards the queued commands.
+    When the Cache auto-batches, the pipeline is the one of the
+    calling thread, which is only sent once it is full or old enough.
+
+    Args:
+        self: The Cache instance being instrumented.
+
+    Yields:
+        The open pipeline, or the plain Redis client.
+    """
+    local = getattr(self, "_local", None)
+    pipe = getattr(local, "pipe", None)
+    if pipe is not None:
+        yield pipe
+        return
+    batcher = getattr(self, "_batcher", None)
+    if batcher is not None:
+        with batcher.queue() as pipe:
+            local.pipe = pipe
+            try:
+                yield pipe
+            finally:
+                local.pipe = None
+        return
+    if not getattr(self, "_pipelined", False):
+        yield self._redis
+        return
+    pipe = self._redis.pipeline(transaction=self._transaction)
+    local.pipe = pipe
+    try:
+        yield pipe
+        pipe.execute()
+    finally:
+        local.pipe = None
+        pipe.reset()
 
 
 def count_calls(method: Callable) -> Callable:
     """Tracks the number of calls
     made to a method in a Cache class.
     Increments a Redis key that
-    corresponds to the method's qualified name.
+    corresponds to the method's qualified name,
+    or the buffered counter of the Cache when it has one.
 
     Args:
         method (Callable): The method to be decorated.
@@ -29,17 +276,128 @@ def count_calls(method: Callable) -> Callable:
     def wrapper(self, *args, **kwargs) -> Any:
         """Invokes the given method after
         incrementing its call counter."""
-        if isinstance(self._redis, redis.Redis):
-            self._redis.incr(method.__qualname__)
-        return method(self, *args, **kwargs)
+        if not isinstance(self._redis, redis.Redis):
+            return method(self, *args, **kwargs)
+        name = _prefixed(self, method.__qualname__)
+        counter = getattr(self, "_counter", None)
+        if counter is not None:
+            counter.add(name)
+            return method(self, *args, **kwargs)
+        with _instrumented(self) as client:
+            client.incr(name)
+            return method(self, *args, **kwargs)
 
     return wrapper
 
 
+def _sampled(self) -> bool:
+    """Decides whether a call is recorded in the call history.
+    One call in history_sample is recorded, picked at random.
+    """
+    rate = getattr(self, "_history_sample", 1)
+    return rate <= 1 or random.random() * rate < 1
+
+
+def _push_history(self, client: Any, key: str, *values: Any) -> None:
+    """Appends entries to a call history list.
+    When the Cache caps its history, the list is trimmed to the
+    newest history_maxlen entries in the same MULTI/EXEC as the
+    RPUSH, so it behaves as a ring buffer and never outgrows the cap.
+
+    Args:
+        self: The Cache instance being instrumented.
+        client: The client or open pipeline to queue commands on.
+        key (str): The history list key.
+        values: The entries to append.
+    """
+    maxlen = getattr(self, "_history_maxlen", None)
+    if maxlen is None:
+        client.rpush(key, *values)
+        return
+    pipe = client.pipeline() if client is self._redis else client
+    pipe.rpush(key, *values)
+    pipe.ltrim(key, -maxlen, -1)
+    if pipe is not client:
+        pipe.execute()
+
+
+def _add_history_entry(
+    self,
+    client: Any,
+    key: str,
+    args: tuple,
+    data: Any,
+    exception: str,
+    started: float,
+    duration: float,
+) -> None:
+    """Appends one call to a call history stream.
+    The stream is trimmed to about history_maxlen entries
+    by the same XADD when the Cache caps its history.
+
+    Args:
+        self: The Cache instance being instrumented.
+        client: The client or open pipeline to queue the XADD on.
+        key (str): The history stream key.
+        args (tuple): The positional arguments of the call.
+        data: The value returned by the call.
+        exception (str): The repr of the exception raised, if any.
+        started (float): The wall-clock time the call started.
+        duration (float): The seconds the call took.
+    """
+    client.xadd(
+        key,
+        {
+            "input": str(args),
+            "output": "" if data is None else data,
+            "exception": exception,
+            "time": started,
+            "duration": duration,
+        },
+        maxlen=getattr(self, "_history_maxlen", None),
+        approximate=True,
+    )
+
+
+def _stream_call(self, method: Callable, args: tuple, kwargs: dict) -> Any:
+    """Calls an instrumented method and records it in its history stream.
+    The entry is queued after the call on the same client, so a
+    pipelined Cache still makes one round trip; the duration then
+    only covers the client side of the call. A call that raises is
+    recorded with its exception when it was sent to Redis directly.
+    On a pipelined or auto-batched Cache its pipeline, count
+    included, is discarded, so it is not recorded either, and the
+    stream stays consistent with the call count.
+    """
+    key = _prefixed(self, f"{method.__qualname__}:history")
+    started = time.time()
+    clock = time.perf_counter()
+    client = None
+    try:
+        with _instrumented(self) as client:
+            data = method(self, *args, **kwargs)
+            _add_history_entry(
+                self, client, key, args, data, "",
+                started, time.perf_counter() - clock
+                )
+    except Exception as exc:
+        if client is self._redis:
+            _add_history_entry(
+                self, self._redis, key, args, None, repr(exc),
+                started, time.perf_counter() - clock
+                )
+        raise
+    return data
+
+
 def call_history(method: Callable) -> Callable:
     """Tracks the call history
     of a method in a Cache class.
-    Stores the inputs and outputs of the method calls.
+    Stores the inputs and outputs of the method calls,
+    capped and sampled as configured on the Cache. With the
+    stream history backend, each call is one entry of the
+    <qualname>:history stream, holding its input, output,
+    exception, start time and duration.
 
     Args:
         method (Callable): The method to be decorated.
@@ -51,20 +409,109 @@ def call_history(method: Callable) -> Callable:
 
     @wraps(method)
     def wrapper(self, *args, **kwargs) -> Any:
-        key_input = f"{method.__qualname__}:inputs"
-        key_output = f"{method.__qualname__}:outputs"
-        if isinstance(self._redis, redis.Redis):
-            self._redis.rpush(key_input, str(args))
-        data = method(self, *args, **kwargs)
-        if isinstance(self._redis, redis.Redis):
-            self._redis.rpush(key_output, data)
+        key_input = _prefixed(self, f"{method.__qualname__}:inputs")
+        key_output = _prefixed(self, f"{method.__qualname__}:outputs")
+        if not isinstance(self._redis, redis.Redis) or not _sampled(self):
+            return method(self, *args, **kwargs)
+        if getattr(self, "_history_backend", "lists") == "stream":
+            return _stream_call(self, method, args, kwargs)
+        with _instrumented(self) as client:
+            _push_history(self, client, key_input, str(args))
+            data = method(self, *args, **kwargs)
+            _push_history(self, client, key_output, data)
         return data
 
     return wrapper
 
 
-def replay(fn: Callable) -> None:
-    """Displays the call history of a Cache class method"""
+def track_latency(method: Callable) -> Callable:
+    """Tracks the latency
+    of a method in a Cache class.
+    Records the duration of each call in the latency histogram
+    of the Cache, if it tracks latency, which flushes it to the
+    <qualname>:latency hash at most once per flush interval.
+    A failed flush neither
+    replaces the result nor the error of the method; its counts
+    are kept for the next one.
+
+    Args:
+        method (Callable): The method to be decorated.
+
+    Returns:
+        Callable: The wrapped method that records its latency.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs) -> Any:
+        """Invokes the given method and records how long it took."""
+        histogram = getattr(self, "_latency", None)
+        if histogram is None or not isinstance(self._redis, redis.Redis):
+            return method(self, *args, **kwargs)
+        clock = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            histogram.observe(_prefixed(self, method.__qualname__),
+                              time.perf_counter() - clock)
+        if histogram.due():
+            try:
+                histogram.flush(self._redis)
+            except redis.RedisError:
+                pass
+        return result
+
+    return wrapper
+
+
+def scripted_variant(method: Callable) -> Callable:
+    """Routes the calls of a method in a Cache class
+    to its scripted variant, _<name>_scripted, when the Cache is
+    scripted. The variant counts and records the call itself, in
+    the same round trip, so the count_calls and call_history
+    decorators below this one are skipped. It is passed the
+    inputs as call_history would record them.
+
+    Args:
+        method (Callable): The method to be decorated.
+
+    Returns:
+        Callable: The wrapped method.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs) -> Any:
+        """Invokes the scripted variant or the given method."""
+        if self._scripted and isinstance(self._redis, redis.Redis):
+            variant = getattr(self, f"_{method.__name__}_scripted")
+            return variant(str(args), *args, **kwargs)
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def history(
+    fn: Callable,
+    last: int = None,
+    offset: int = 0,
+    predicate: Callable = None,
+    page_size: int = 1000,
+) -> Iterator[Tuple[str, str]]:
+    """Lazily yields the call history of a Cache class method.
+    The inputs and outputs lists are read page_size entries at a
+    time, both pages in one round trip, so memory is bounded by
+    the page size rather than by the length of the history.
+
+    Args:
+        fn (Callable): The bound, instrumented Cache method.
+        last (int): Only yield the newest last calls.
+        offset (int): Skip the calls before this index.
+        predicate (Callable): Called with the input and output
+        of each call; only the calls it returns True for are yielded.
+        page_size (int): The number of entries read per round trip.
+
+    Yields:
+        Tuple[str, str]: The input and output of each call, oldest first.
+    """
     if fn is None or not hasattr(fn, "__self__"):
         return
 
@@ -72,20 +519,785 @@ def replay(fn: Callable) -> None:
     if not isinstance(redius, redis.Redis):
         return
 
-    method_name = fn.__qualname__
+    _flush_batches(fn.__self__)
+    if getattr(fn.__self__, "_history_backend", "lists") == "stream":
+        for call in stream_history(fn, last, offset, page_size):
+            entry = (call["input"], call["output"])
+            if call["exception"]:
+                entry = (call["input"], f"raised {call['exception']}")
+            if predicate is None or predicate(*entry):
+                yield entry
+        return
+
+    method_name = _prefixed(fn.__self__, fn.__qualname__)
     in_key = f"{method_name}:inputs"
     out_key = f"{method_name}:outputs"
-    num_of_calls = int(redius.get(method_name) or 0)
+
+    pipe = redius.pipeline(transaction=False)
+    pipe.llen(in_key)
+    pipe.llen(out_key)
+    length = min(pipe.execute())
+    start = offset
+    if last is not None:
+        start = max(start, length - last)
+
+    for page in range(start, length, page_size):
+        end = min(page + page_size, length) - 1
+        pipe.lrange(in_key, page, end)
+        pipe.lrange(out_key, page, end)
+        inputs, outputs = pipe.execute()
+        for ins, outs in zip(inputs, outputs):
+            entry = (ins.decode("utf-8"), outs.decode("utf-8"))
+            if predicate is None or predicate(*entry):
+                yield entry
+
+
+def stream_history(
+    fn: Callable,
+    last: int = None,
+    offset: int = 0,
+    page_size: int = 1000,
+) -> Iterator[dict]:
+    """Lazily yields the calls recorded in a history stream.
+    Entries are read page_size at a time with XRANGE. The first
+    entry of the window is reached from whichever end of the
+    stream is closer, walking back with XREVRANGE when needed.
+
+    Args:
+        fn (Callable): The bound, instrumented Cache method.
+        last (int): Only yield the newest last calls.
+        offset (int): Skip the calls before this index.
+        page_size (int): The number of entries read per round trip.
+
+    Yields:
+        dict: The id, input, output, exception, time and
+        duration of each call, oldest first.
+    """
+    if fn is None or not hasattr(fn, "__self__"):
+        return
+
+    redius = getattr(fn.__self__, "_redis", None)
+    if not isinstance(redius, redis.Redis):
+        return
+
+    _flush_batches(fn.__self__)
+    key = _prefixed(fn.__self__, f"{fn.__qualname__}:history")
+    length = redius.xlen(key)
+    first = offset
+    if last is not None:
+        first = max(first, length - last)
+    if first >= length:
+        return
+
+    low, skip = "-", first
+    if length - first < first:
+        high, remaining = "+", length - first
+        while remaining > 0:
+            page = redius.xrevrange(
+                key, high, "-", count=min(page_size, remaining))
+            if not page:
+                break
+            remaining -= len(page)
+            low = page[-1][0]
+            high = b"(" + low
+        skip = 0
+
+    while True:
+        page = redius.xrange(key, low, "+", count=page_size)
+        if not page:
+            return
+        low = b"(" + page[-1][0]
+        for entry_id, fields in page[skip:]:
+            yield {
+                "id": entry_id.decode("utf-8"),
+                "input": fields[b"input"].decode("utf-8"),
+                "output": fields[b"output"].decode("utf-8"),
+                "exception": fields[b"exception"].decode("utf-8"),
+                "time": float(fields[b"time"]),
+                "duration": float(fields[b"duration"]),
+            }
+        skip = max(0, skip - len(page))
+
+
+def replay(
+    fn: Callable,
+    last: int = None,
+    offset: int = 0,
+    predicate: Callable = None,
+    page_size: int = 1000,
+) -> None:
+    """Displays the call history of a Cache class method.
+    The history is streamed page by page, see history.
+    Buffered call counts and batched commands are flushed first.
+    """
+    if fn is None or not hasattr(fn, "__self__"):
+        return
+
+    redius = getattr(fn.__self__, "_redis", None)
+    if not isinstance(redius, redis.Redis):
+        return
+
+    counter = getattr(fn.__self__, "_counter", None)
+    if counter is not None:
+        counter.flush()
+    _flush_batches(fn.__self__)
+
+    method_name = fn.__qualname__
+    num_of_calls = int(redius.get(_prefixed(fn.__self__, method_name)) or 0)
 
     print(f"{method_name} was called {num_of_calls} times:")
 
-    inputs = redius.lrange(in_key, 0, -1)
-    outputs = redius.lrange(out_key, 0, -1)
+    for ins, outs in history(fn, last, offset, predicate, page_size):
+        print(f"{method_name}(*{ins}) -> {outs}")
 
-    for ins, outs in zip(inputs, outputs):
-        print(
-            f'{method_name}(*{ins.decode("utf-8")}) -> {outs.decode("utf-8")}'
-            )
+
+def latency_report(
+    fn: Callable,
+    percentiles: Sequence[float] = (50, 95, 99),
+) -> None:
+    """Displays the latency summary of a Cache class method.
+    The local histogram is flushed first, so the summary
+    includes the calls made since the last flush.
+    """
+    if fn is None or not hasattr(fn, "__self__"):
+        return
+
+    redius = getattr(fn.__self__, "_redis", None)
+    if not isinstance(redius, redis.Redis):
+        return
+
+    histogram = getattr(fn.__self__, "_latency", None)
+    if histogram is not None:
+        histogram.flush(redius)
+
+    method_name = fn.__qualname__
+    name = _prefixed(fn.__self__, method_name)
+    counts = LatencyHistogram.load(redius, name)
+    total = sum(counts)
+    elapsed = float(redius.hget(f"{name}:latency", "sum") or 0)
+
+    print(f"{method_name} latency over {total} calls:")
+    if not total:
+        return
+    print(f"\tmean: {elapsed * 1000 / total:.3f} ms")
+    for q in percentiles:
+        value = LatencyHistogram.percentile(counts, q)
+        print(f"\tp{q:g}: {value:.3f} ms")
+
+
+def _shared_histogram(
+    client: redis.Redis, flush_interval: float
+) -> "LatencyHistogram":
+    """Returns the latency histograms of the Caches on the connection
+    pool of a client, made on first use with the flush interval of
+    the first Cache, so Caches made per request add up their calls
+    and flush them together.
+    """
+    pool = getattr(client, "connection_pool", client)
+    with _histograms_lock:
+        histogram = _histograms.get(pool)
+        if histogram is None:
+            histogram = _histograms[pool] = LatencyHistogram(
+                flush_interval, client)
+    return histogram
+
+
+class LatencyHistogram:
+    """Represents fixed-bucket latency histograms
+    aggregated in-process for the methods of the Caches
+    sharing a connection pool.
+
+    Each method's histogram is flushed to the <qualname>:latency
+    hash with HINCRBY, one field per bucket upper bound in
+    milliseconds plus the total seconds in "sum", so histograms
+    from many processes add up in Redis. Histograms given a client
+    are also flushed by the flusher thread shared with the call
+    counters, so the calls of an idle process still reach Redis,
+    and at process exit.
+    """
+
+    BUCKETS = (
+        0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50,
+        100, 250, 500, 1000, 2500, 5000, 10000, math.inf,
+    )
+
+    def __init__(
+        self,
+        flush_interval: float = 10.0,
+        client: redis.Redis = None,
+    ) -> None:
+        """Initializes empty histograms.
+
+        Args:
+            flush_interval (float): The seconds between flushes.
+            client (redis.Redis): The client of background flushes,
+            or None to only flush when flush is called.
+        """
+        self.flush_interval = flush_interval
+        self.client = client
+        self._counts: Dict[str, List[int]] = {}
+        self._sums: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Records one call of a method that took seconds."""
+        bucket = bisect_left(self.BUCKETS, seconds * 1000)
+        with self._lock:
+            counts = self._counts.get(name)
+            if counts is None:
+                counts = self._counts[name] = [0] * len(self.BUCKETS)
+                self._sums[name] = 0.0
+                if self.client is not None:
+                    _mark_dirty(self)
+            counts[bucket] += 1
+            self._sums[name] += seconds
+
+    def due(self) -> bool:
+        """Tells whether the flush interval has elapsed."""
+        return time.monotonic() - self._flushed >= self.flush_interval
+
+    def flush(self, client: redis.Redis = None) -> None:
+        """Adds the local histograms to Redis in one round trip
+        and starts new empty ones. Histograms that cannot be sent
+        are kept for the next flush.
+
+        Args:
+            client (redis.Redis): The client to send them with,
+            defaults to the client of the histograms.
+        """
+        with self._lock:
+            counts, sums = self._counts, self._sums
+            self._counts, self._sums = {}, {}
+            self._flushed = time.monotonic()
+        if counts:
+            pipe = (client or self.client).pipeline(transaction=False)
+            for name, buckets in counts.items():
+                key = f"{name}:latency"
+                for bound, count in zip(self.BUCKETS, buckets):
+                    if count:
+                        pipe.hincrby(key, f"{bound:g}", count)
+                pipe.hincrbyfloat(key, "sum", sums[name])
+            try:
+                pipe.execute()
+            except redis.RedisError:
+                with self._lock:
+                    for name, buckets in counts.items():
+                        kept = self._counts.setdefault(
+                            name, [0] * len(self.BUCKETS))
+                        for i, count in enumerate(buckets):
+                            kept[i] += count
+                        self._sums[name] = \
+                            self._sums.get(name, 0.0) + sums[name]
+                raise
+        with self._lock:
+            if not self._counts:
+                _mark_clean(self)
+
+    def _background_flush(self, force: bool) -> None:
+        """Flushes the histograms from the flusher thread once the
+        flush interval has elapsed, or now if force is set.
+        """
+        if force or self.due():
+            try:
+                self.flush()
+            except redis.RedisError:
+                pass
+
+    @classmethod
+    def load(cls, client: redis.Redis, name: str) -> List[int]:
+        """Reads the flushed histogram of a method from Redis.
+
+        Returns:
+            List[int]: The number of calls in each bucket.
+        """
+        fields = client.hgetall(f"{name}:latency")
+        return [
+            int(fields.get(f"{bound:g}".encode(), 0))
+            for bound in cls.BUCKETS
+        ]
+
+    @classmethod
+    def percentile(cls, counts: Sequence[int], q: float) -> float:
+        """Estimates a latency percentile from bucket counts.
+        The value is interpolated linearly inside its bucket;
+        for the last, unbounded bucket its lower bound is returned.
+
+        Args:
+            counts (Sequence[int]): The number of calls per bucket.
+            q (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The estimated latency in milliseconds.
+        """
+        rank = sum(counts) * q / 100
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = cls.BUCKETS[i - 1] if i else 0.0
+                upper = cls.BUCKETS[i]
+                if math.isinf(upper):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+
+class CallCounter:
+    """Represents call counters
+    aggregated in-process for the methods of a Cache.
+
+    Counts are added to Redis with one INCRBY per method, by the
+    flusher thread shared by every counter, when threshold calls are
+    pending, and at process exit. INCRBY adds up, so the totals stay
+    exact across any number of worker processes.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        flush_interval: float = 1.0,
+        threshold: int = 1000,
+    ) -> None:
+        """Initializes empty counters.
+
+        Args:
+            client (redis.Redis): The client the counts go to.
+            flush_interval (float): The seconds between timed flushes.
+            threshold (int): The pending calls that trigger a flush.
+        """
+        self.client = client
+        self.flush_interval = flush_interval
+        self.threshold = threshold
+        self._counts: Dict[str, int] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flushed = time.monotonic()
+        _forked.add(self)
+
+    def add(self, name: str, count: int = 1) -> None:
+        """Counts calls of a method, flushing at the threshold."""
+        with self._lock:
+            if not self._counts:
+                _mark_dirty(self)
+            self._counts[name] = self._counts.get(name, 0) + count
+            self._pending += count
+            due = self._pending >= self.threshold
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Adds the pending counts to Redis in one round trip.
+        If Redis cannot be reached, the counts are kept pending.
+        """
+        with self._lock:
+            counts = self._counts
+            self._counts, self._pending = {}, 0
+            self._flushed = time.monotonic()
+        if counts:
+            pipe = self.client.pipeline(transaction=False)
+            for name, count in counts.items():
+                pipe.incrby(name, count)
+            try:
+                pipe.execute()
+            except redis.RedisError:
+                with self._lock:
+                    for name, count in counts.items():
+                        self._counts[name] = \
+                            self._counts.get(name, 0) + count
+                        self._pending += count
+                raise
+        with self._lock:
+            if not self._counts:
+                _mark_clean(self)
+
+    def _background_flush(self, force: bool) -> None:
+        """Flushes the counts from the flusher thread once the flush
+        interval has elapsed, or now if force is set; counts that
+        cannot be sent stay pending for the next flush.
+        """
+        if force or time.monotonic() - self._flushed >= self.flush_interval:
+            try:
+                self.flush()
+            except redis.RedisError:
+                pass
+
+    def _after_fork(self) -> None:
+        """Drops the counts inherited from the parent process,
+        which the parent flushes itself.
+        """
+        self._lock = threading.Lock()
+        self._counts, self._pending = {}, 0
+
+
+class _Batch:
+    """Represents the pipeline
+    a thread queues its auto-batched commands on.
+    """
+
+    def __init__(self, client: redis.Redis, transaction: bool) -> None:
+        """Initializes an empty batch for the calling thread."""
+        self.pipe = client.pipeline(transaction=transaction)
+        self.lock = threading.RLock()
+        self.deadline = None
+        self.thread = threading.current_thread()
+
+    def send(self) -> None:
+        """Executes the queued commands, if any; hold lock to call it."""
+        self.deadline = None
+        if len(self.pipe):
+            self.pipe.execute()
+
+
+class AutoBatcher:
+    """Represents per-thread pipelines that combine the commands
+    of consecutive instrumented calls of a Cache.
+
+    Each thread queues on its own pipeline, so threads never wait
+    for each other. A pipeline is sent once it holds max_commands
+    commands, by the shared flusher thread once its first command is
+    interval seconds old or its thread has exited, and at process
+    exit. The errors of sends made by the flusher thread cannot be
+    raised to a caller; since some of the commands may have been
+    applied, they are not retried but counted.
+
+    Attributes:
+        dropped (int): The commands lost to failed background sends.
+        last_error (Exception): The error of the last failed one.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        max_commands: int = 100,
+        interval: float = 0.002,
+        transaction: bool = False,
+    ) -> None:
+        """Initializes the batcher.
+
+        Args:
+            client (redis.Redis): The client the commands go to.
+            max_commands (int): The queued commands that trigger a send.
+            interval (float): The seconds a command may wait.
+            transaction (bool): Wrap each send in MULTI/EXEC.
+        """
+        self.client = client
+        self.max_commands = max_commands
+        self.interval = interval
+        self.transaction = transaction
+        self._local = threading.local()
+        self._batches: List[_Batch] = []
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.last_error = None
+        _forked.add(self)
+
+    @property
+    def flush_interval(self) -> float:
+        """The seconds between the checks of the flusher thread."""
+        return self.interval
+
+    def _batch(self) -> _Batch:
+        """Returns the batch of the calling thread."""
+        batch = getattr(self._local, "batch", None)
+        if batch is None:
+            batch = self._local.batch = _Batch(self.client, self.transaction)
+            with self._lock:
+                self._batches.append(batch)
+        return batch
+
+    @contextmanager
+    def queue(self) -> Iterator[Any]:
+        """Yields the pipeline of the calling thread to queue the
+        commands of one call on. The commands of a call that raises
+        are discarded, and the batch is sent once it is full.
+        """
+        batch = self._batch()
+        with batch.lock:
+            queued = len(batch.pipe)
+            try:
+                yield batch.pipe
+            except BaseException:
+                del batch.pipe.command_stack[queued:]
+                raise
+            if batch.deadline is None and len(batch.pipe):
+                batch.deadline = time.monotonic() + self.interval
+                with self._lock:
+                    _mark_dirty(self)
+            if len(batch.pipe) >= self.max_commands:
+                batch.send()
+                self._mark_idle()
+
+    def _mark_idle(self) -> None:
+        """Leaves the flusher thread once no batch holds commands."""
+        with self._lock:
+            if all(batch.deadline is None for batch in self._batches):
+                _mark_clean(self)
+
+    def flush(self) -> None:
+        """Sends the commands queued by the calling thread."""
+        batch = getattr(self._local, "batch", None)
+        if batch is not None:
+            with batch.lock:
+                batch.send()
+            self._mark_idle()
+
+    def flush_all(self) -> None:
+        """Sends the commands queued by every thread."""
+        with self._lock:
+            batches = list(self._batches)
+        for batch in batches:
+            with batch.lock:
+                batch.send()
+        self._mark_idle()
+
+    def _background_flush(self, force: bool) -> None:
+        """Sends, from the flusher thread, the batches whose first
+        command is interval seconds old, every batch if force is set,
+        and the batches of threads that have exited, which are then
+        forgotten.
+        """
+        now = time.monotonic()
+        with self._lock:
+            batches = list(self._batches)
+        for batch in batches:
+            alive = batch.thread.is_alive()
+            deadline = batch.deadline
+            if force or not alive or (
+                    deadline is not None and deadline <= now):
+                with batch.lock:
+                    commands = len(batch.pipe)
+                    try:
+                        batch.send()
+                    except redis.RedisError as error:
+                        with self._lock:
+                            self.dropped += commands
+                            self.last_error = error
+            if not alive:
+                with self._lock:
+                    if batch in self._batches:
+                        self._batches.remove(batch)
+        self._mark_idle()
+
+    def _after_fork(self) -> None:
+        """Drops the batches inherited from the parent process,
+        which the parent sends itself.
+        """
+        self._local = threading.local()
+        self._batches = []
+        self._lock = threading.Lock()
+
+
+class NearCache:
+    """Represents a bounded in-process cache
+    in front of the Redis reads of a Cache.
+
+    Entries are evicted least recently used first once maxsize
+    keys are held, and expire after ttl seconds when a ttl is set,
+    or sooner when their key expires sooner in Redis.
+    The converted result of get, get_str and get_int is cached per
+    conversion function, so repeated get_int calls do not parse
+    bytes again; the results of other functions are not cached.
+    An invalidation only discards the reads of the keys it names,
+    so the writes of other keys do not stop reads from caching.
+
+    Attributes:
+        hits (int): The number of reads served from memory.
+        misses (int): The number of reads that went to Redis.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None) -> None:
+        """Initializes an empty NearCache.
+
+        Args:
+            maxsize (int): The maximum number of keys held.
+            ttl (float): The seconds an entry stays valid,
+            or None for entries that only expire by eviction.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+        self._enabled = True
+        self._listener = None
+        self._tracker = None
+        _forked.add(self)
+
+    def __len__(self) -> int:
+        """Returns the number of keys held."""
+        return len(self._entries)
+
+    def token(self) -> int:
+        """Returns the invalidation generation to pass to put.
+        A value read from Redis is only cached if no invalidation
+        of its key arrived between token and put.
+        """
+        return self._generation
+
+    def get(self, key: str, fn: Callable = None) -> Any:
+        """Looks up the value of a key converted by fn.
+
+        Args:
+            key (str): The Redis key for the data.
+            fn (Optional[Callable]): The conversion function.
+
+        Returns:
+            The cached value, or _MISSING when it is not held.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None \
+                    and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None or fn not in entry[1]:
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1][fn]
+
+    def put(
+        self,
+        key: str,
+        fn: Callable,
+        value: Any,
+        token: int,
+        ttl: float = None,
+    ) -> None:
+        """Caches the value of a key converted by fn.
+
+        Args:
+            key (str): The Redis key for the data.
+            fn (Optional[Callable]): The conversion function.
+            value: The converted value.
+            token (int): The generation returned by token
+            before the value was read from Redis.
+            ttl (float): The seconds the key has left in Redis,
+            which the entry never outlives, or None.
+        """
+        if fn not in _NEAR_CACHED:
+            return
+        lifetimes = [t for t in (self.ttl, ttl) if t is not None]
+        with self._lock:
+            if not self._enabled or token < self._floor \
+                    or self._invalidated.get(key, token) > token:
+                return
+            expires = None
+            if lifetimes:
+                expires = time.monotonic() + min(lifetimes)
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = (expires, {})
+            elif expires is not None and \
+                    (entry[0] is None or expires < entry[0]):
+                entry = self._entries[key] = (expires, entry[1])
+            entry[1][fn] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys: Union[str, bytes]) -> None:
+        """Drops the given keys, or every key if none are given."""
+        with self._lock:
+            self._generation += 1
+            if not keys:
+                self._floor = self._generation
+                self._entries.clear()
+            for key in keys:
+                if isinstance(key, bytes):
+                    key = key.decode("utf-8")
+                self._entries.pop(key, None)
+                self._invalidated.pop(key, None)
+                self._invalidated[key] = self._generation
+            while len(self._invalidated) > self.maxsize:
+                _, generation = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, generation)
+
+    def track(self, client: redis.Redis, *prefixes: str) -> None:
+        """Subscribes to Redis client-side caching invalidations.
+        Server-assisted tracking is enabled in broadcasting mode,
+        so a write to a matching key from any client drops it here.
+        The messages are redirected to a listener connection
+        subscribed to __redis__:invalidate. Both connections speak
+        RESP2, whatever the protocol of the client, since a RESP3
+        connection delivers the subscription replies and the
+        invalidations as push messages, which read_response skips;
+        the RESP3-only maintenance notifications are left off.
+        If the listener loses its
+        connection, the cache is emptied and stops caching, since
+        invalidations may have been missed.
+
+        Args:
+            client (redis.Redis): A client of the Redis server.
+            prefixes (str): The key prefixes to track, all keys
+            when none are given.
+        """
+        pool = client.connection_pool
+        kwargs = {
+            name: value for name, value in pool.connection_kwargs.items()
+            if not name.startswith("maint_notifications")
+        }
+        kwargs["protocol"] = 2
+        self._listener = listener = pool.connection_class(**kwargs)
+        self._tracker = tracker = pool.connection_class(**kwargs)
+        args = ["CLIENT", "TRACKING", "ON", "REDIRECT", None, "BCAST"]
+        for prefix in prefixes:
+            args += ["PREFIX", prefix]
+        try:
+            listener.send_command("CLIENT", "ID")
+            args[4] = listener.read_response()
+            listener.send_command("SUBSCRIBE", "__redis__:invalidate")
+            listener.read_response()
+            tracker.send_command(*args)
+            tracker.read_response()
+        except redis.RedisError:
+            self.close()
+            raise
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self) -> None:
+        """Applies invalidation messages until the listener closes."""
+        try:
+            while True:
+                message = self._listener.read_response()
+                if message[0] != b"message":
+                    continue
+                keys = message[2]
+                if keys is None:
+                    self.invalidate()
+                else:
+                    self.invalidate(*keys)
+        except (redis.RedisError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self._enabled = False
+                self._generation += 1
+                self._entries.clear()
+
+    def _after_fork(self) -> None:
+        """Drops the lock inherited from the parent process. A tracking
+        NearCache is emptied and stops caching, since its listener
+        thread does not survive a fork.
+        """
+        self._lock = threading.Lock()
+        if self._listener is not None:
+            self._enabled = False
+            self._generation += 1
+            self._entries.clear()
+            self._listener = self._tracker = None
+
+    def close(self) -> None:
+        """Stops tracking and closes its connections."""
+        for connection in (self._tracker, self._listener):
+            if connection is not None:
+                connection.disconnect()
 
 
 class Cache:
@@ -109,19 +1321,287 @@ class Cache:
 
         get_int(key: str) -> Optional[int]:
             Retrieves the data as an integer.
+
+        store_many(values: Iterable) -> List[str]:
+            Stores a batch of values, one round trip per chunk.
+
+        get_many(keys: Iterable[str], fn: Optional[Callable] = None)
+        -> List:
+            Retrieves a batch of values, one round trip per chunk.
+
+        store_stream(data: Union[bytes-like, BinaryIO]) -> str:
+            Stores a large value one chunk at a time.
+
+        get_into(key: str, out: Union[bytearray, BinaryIO]) -> int:
+            Reads a large value into a buffer or file by chunks.
+
+        release(key: str) -> int:
+            Drops a reference to a content addressed value.
+
+        flush_batch() -> None:
+            Sends the commands auto-batched by the calling thread.
+
+        memoize(ttl: Optional[float] = None,
+        key_fn: Optional[Callable] = None) -> Callable:
+            Decorates a function with read-through caching.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        client: redis.Redis = None,
+        connection_pool: redis.ConnectionPool = None,
+        flush: bool = False,
+        namespace: str = "",
+        pipelined: bool = False,
+        transaction: bool = True,
+        batch_size: int = 1000,
+        near_cache: NearCache = None,
+        history_maxlen: int = None,
+        history_sample: int = 1,
+        history_backend: str = "lists",
+        latency: bool = False,
+        latency_flush_interval: float = 10.0,
+        buffered_counts: bool = False,
+        count_flush_interval: float = 1.0,
+        count_flush_threshold: int = 1000,
+        codec: Any = None,
+        compress_threshold: int = None,
+        content_addressed: bool = False,
+        refcount: bool = False,
+        ttl: float = None,
+        sliding: bool = False,
+        autobatch: int = None,
+        autobatch_interval: float = 0.002,
+        scripted: bool = False,
+    ) -> None:
         """Initializes a Cache instance.
-        This ensures that the Redis cache is
-        empty when the Cache instance is created.
+        No connection is opened and nothing is sent to Redis
+        unless flush is set, so a Cache can be made per request.
+
+        Args:
+            client (redis.Redis): The client to use, defaults to
+            one on the connection pool shared by the process.
+            connection_pool (redis.ConnectionPool): The pool to
+            use when no client is given, instead of the shared one.
+            flush (bool): Empty the Redis database first.
+            namespace (str): Prefix every key the Cache reads or
+            writes, its counters and histories included, with
+            "<namespace>:", so Caches can share a database. Keys
+            returned by store are given and taken without it.
+            pipelined (bool): Queue the commands of the
+            instrumentation decorators on the same pipeline as
+            the wrapped method, so an instrumented call costs
+            one round trip instead of one per command.
+            transaction (bool): Wrap that pipeline in MULTI/EXEC.
+            batch_size (int): The number of values sent per
+            round trip by store_many and get_many.
+            near_cache (NearCache): An in-process cache that
+            get, get_str and get_int read through. Keys made by
+            store are never rewritten, so they are safe to cache;
+            call near_cache.track to also see other writers. With
+            a ttl, a read also fetches the PTTL of its key in the
+            same round trip, and the entry expires with the key.
+            history_maxlen (int): Keep only the newest entries
+            of each call history list, or all of them if None.
+            history_sample (int): Record the history of one call
+            in this many; call counts stay exact.
+            history_backend (str): "lists" to keep the history in
+            the <qualname>:inputs and :outputs lists, or "stream"
+            to keep one entry per call, with its exception and
+            timing, in the <qualname>:history stream.
+            latency (bool): Record the latency histograms of store,
+            get and store_stream, aggregated with those of the other
+            Caches on the same connection pool.
+            latency_flush_interval (float): The seconds between
+            flushes of the latency histograms.
+            buffered_counts (bool): Aggregate the count_calls
+            counters in-process instead of sending one INCR per call.
+            count_flush_interval (float): The seconds between
+            flushes of the buffered counters.
+            count_flush_threshold (int): The pending calls that
+            trigger an early flush of the buffered counters.
+            codec: A codec name ("raw", "struct", "pickle" or
+            "json") or instance from serialization. Values are then
+            stored with a type tag and get returns them as their
+            original type without fn. None stores values as is.
+            compress_threshold (int): Compress encoded values of
+            at least this many bytes with zlib; needs a codec.
+            content_addressed (bool): Key each value by a hash of
+            its stored bytes instead of a random UUID, and write it
+            with SET NX, so identical values share one copy.
+            refcount (bool): Count the stores of each content
+            addressed value in <key>:refs, so release can delete
+            the value when its last reference goes.
+            ttl (float): The seconds before stored values expire,
+            unless store is given its own ttl. None keeps them.
+            sliding (bool): Reset the ttl of a value each time get
+            or get_many reads it, with GETEX. Values served by the
+            near cache do not reach Redis, so give it a shorter ttl.
+            autobatch (int): Queue the commands of instrumented calls,
+            such as store, on a pipeline per thread, sent once it holds
+            this many commands, instead of one round trip per call.
+            Reads by a thread send its batch first, so it always
+            reads its own writes; replay and history send every batch.
+            None sends each call on its own.
+            autobatch_interval (float): The seconds a batched command
+            may wait before it is sent.
+            scripted (bool): Make each store one EVALSHA of a Lua
+            script that increments the call count, records the
+            history and sets the value, so concurrent calls can
+            never interleave their history entries. The script is
+            loaded once per connection pool with SCRIPT LOAD; if the
+            server refuses it, the same commands are sent in a
+            MULTI/EXEC pipeline instead. Needs the lists history
+            backend, unbuffered counts and random keys.
+
+        A forked child process replaces the connection pool of every
+        Cache, including the shared one, and rebuilds its in-process
+        state, so a Cache made before a fork keeps working after it.
         """
-        self._redis = redis.Redis()
-        self._redis.flushdb(True)
+        if client is None:
+            client = redis.Redis(
+                connection_pool=connection_pool or shared_pool())
+        self._redis = client
+        if flush:
+            self._redis.flushdb(True)
+        self._prefix = f"{namespace}:" if namespace else ""
+        self._pipelined = pipelined
+        self._transaction = transaction
+        self._batch_size = batch_size
+        self._near_cache = near_cache
+        self._history_maxlen = history_maxlen
+        self._history_sample = history_sample
+        self._history_backend = history_backend
+        self._latency = None
+        if latency:
+            self._latency = _shared_histogram(client, latency_flush_interval)
+        if scripted and (buffered_counts or content_addressed
+                         or history_backend != "lists"):
+            raise ValueError(
+                "a scripted Cache needs the lists history backend, "
+                "unbuffered counts and random keys")
+        self._scripted = scripted
+        self._counter = None
+        if buffered_counts:
+            self._counter = CallCounter(
+                self._redis, count_flush_interval, count_flush_threshold)
+        self._memo_counter = self._counter or CallCounter(
+            self._redis, count_flush_interval, count_flush_threshold)
+        self._codec = None
+        if codec is not None:
+            self._codec = get_codec(codec, compress_threshold)
+        self._content_addressed = content_addressed
+        self._refcount = refcount
+        self._release_script = None
+        self._ttl = ttl
+        self._sliding = sliding
+        self._local = threading.local()
+        self._batcher = None
+        if autobatch is not None:
+            self._batcher = AutoBatcher(
+                self._redis, autobatch, autobatch_interval, transaction)
+        _caches.add(self)
+
+    def _after_fork(self, rebuilt: Callable) -> None:
+        """Moves the Cache to fresh connections in a forked child,
+        and drops the latency samples and thread state of the parent.
+
+        Args:
+            rebuilt (Callable): Returns the replacement of a pool.
+        """
+        pool = getattr(self._redis, "connection_pool", None)
+        if isinstance(pool, redis.ConnectionPool):
+            self._redis.connection_pool = rebuilt(pool)
+        self._local = threading.local()
+        if self._latency is not None:
+            self._latency = _shared_histogram(
+                self._redis, self._latency.flush_interval)
+
+    def flush_batch(self) -> None:
+        """Sends the commands auto-batched by the calling thread."""
+        if self._batcher is not None:
+            self._batcher.flush()
+
+    def _encode(self, data: Any) -> Any:
+        """Encodes a value with the codec of the Cache, if any."""
+        if self._codec is None:
+            return data
+        return self._codec.encode(data)
 
+    def _new_key(self, payload: Any) -> str:
+        """Returns the key to store an encoded value under.
+        Content addressed keys are the BLAKE2b digest of the bytes
+        Redis stores, so equal values always get the same key.
+        """
+        if not self._content_addressed:
+            return str(uuid.uuid4())
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif not isinstance(payload, (bytes, bytearray, memoryview)):
+            payload = repr(payload).encode()
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def _expiry(self, ttl: float = None) -> dict:
+        """Returns the SET/GETEX options for a ttl in seconds,
+        or for the default ttl of the Cache when ttl is None.
+        """
+        if ttl is None:
+            ttl = self._ttl
+        if ttl is None:
+            return {}
+        return {"px": max(1, int(ttl * 1000))}
+
+    def _write(
+        self,
+        client: Any,
+        key: str,
+        payload: Any,
+        ttl: float = None,
+    ) -> None:
+        """Queues the write of an encoded value on a client.
+        The expiry is set by the SET itself. Content addressed
+        values are written with SET NX, which is a no-op for a
+        value already stored, and counted with INCR in the same
+        MULTI/EXEC when the Cache counts references.
+        """
+        expiry = self._expiry(ttl)
+        if not self._content_addressed:
+            client.set(key, payload, **expiry)
+            return
+        if not self._refcount:
+            client.set(key, payload, nx=True, **expiry)
+            return
+        pipe = client.pipeline() if client is self._redis else client
+        pipe.set(key, payload, nx=True, **expiry)
+        pipe.incr(f"{key}:refs")
+        if expiry:
+            pipe.pexpire(f"{key}:refs", expiry["px"])
+        if pipe is not client:
+            pipe.execute()
+
+    def _read(self, client: Any, key: str) -> Any:
+        """Queues the read of a value on a client, with GETEX
+        refreshing its expiry when the Cache has sliding expiration.
+        """
+        if self._sliding and self._ttl is not None:
+            return client.getex(key, **self._expiry())
+        return client.get(key)
+
+    def _convert(self, data: bytes, fn: Callable = None) -> Any:
+        """Decodes a value read from Redis and applies fn to it."""
+        if data is not None and self._codec is not None:
+            data = self._codec.decode(data)
+        return fn(data) if fn is not None else data
+
+    @track_latency
+    @scripted_variant
     @count_calls
     @call_history
-    def store(self, data: Union[str, bytes, int, float]) -> str:
+    def store(
+        self,
+        data: Union[str, bytes, int, float],
+        ttl: float = None,
+    ) -> str:
         """Stores a value in a Redis data
         storage and returns the key.
 
@@ -129,15 +1609,72 @@ class Cache:
             data (Union[str, bytes, int, float]):
                 The data to store in Redis.
                 Can be a string, bytes, int, or float.
+            ttl (float): The seconds before the value expires,
+            defaults to the ttl of the Cache.
 
         Returns:
             str: A unique key generated
             for the stored data.
         """
+        payload = self._encode(data)
+        data_key = self._new_key(payload)
+        with _instrumented(self) as client:
+            self._write(client, _prefixed(self, data_key), payload, ttl)
+        return data_key
+
+    def _store_script(self) -> Any:
+        """Returns the store script, loading it with SCRIPT LOAD on
+        the first use of the connection pool, or False if the server
+        does not run scripts.
+        """
+        pool = getattr(self._redis, "connection_pool", self._redis)
+        script = _store_scripts.get(pool)
+        if script is None:
+            script = self._redis.register_script(_STORE_SCRIPT)
+            try:
+                script.sha = self._redis.script_load(_STORE_SCRIPT)
+            except redis.ResponseError:
+                script = False
+            _store_scripts[pool] = script
+        return script
+
+    def _store_scripted(
+        self,
+        inputs: str,
+        data: Any,
+        ttl: float = None,
+    ) -> str:
+        """Stores a value and records the call atomically,
+        in one round trip, see the scripted option.
+
+        Args:
+            inputs (str): The call inputs, as call_history records them.
+        """
+        payload = self._encode(data)
         data_key = str(uuid.uuid4())
-        self._redis.set(data_key, data)
+        name = _prefixed(self, Cache.store.__qualname__)
+        keys = [name, f"{name}:inputs", _prefixed(self, data_key),
+                f"{name}:outputs"]
+        recorded = _sampled(self)
+        expiry = self._expiry(ttl)
+        script = self._store_script()
+        if script:
+            script(keys=keys, args=[
+                inputs, payload, expiry.get("px", ""), int(recorded),
+                data_key, self._history_maxlen or ""
+            ], client=self._redis)
+            return data_key
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.incr(name)
+        if recorded:
+            _push_history(self, pipe, keys[1], inputs)
+        pipe.set(keys[2], payload, **expiry)
+        if recorded:
+            _push_history(self, pipe, keys[3], data_key)
+        pipe.execute()
         return data_key
 
+    @track_latency
     def get(
         self,
         key: str,
@@ -152,12 +1689,31 @@ class Cache:
 
         Returns:
             Union[str, bytes, int, float]:
-            The retrieved data, optionally converted
-            by the provided function,
+            The retrieved data, decoded by the codec of the Cache
+            and optionally converted by the provided function,
             or None if the key doesn't exist.
         """
-        data = self._redis.get(key)
-        return fn(data) if fn is not None else data
+        self.flush_batch()
+        key = _prefixed(self, key)
+        near_cache = self._near_cache
+        if near_cache is None:
+            return self._convert(self._read(self._redis, key), fn)
+        value = near_cache.get(key, fn)
+        if value is not _MISSING:
+            return value
+        token = near_cache.token()
+        if self._ttl is None:
+            data, ttl = self._read(self._redis, key), None
+        else:
+            pipe = self._redis.pipeline(transaction=False)
+            self._read(pipe, key)
+            pipe.pttl(key)
+            data, pttl = pipe.execute()
+            ttl = pttl / 1000 if pttl >= 0 else None
+        value = self._convert(data, fn)
+        if data is not None:
+            near_cache.put(key, fn, value, token, ttl)
+        return value
 
     def get_str(self, key: str) -> str:
         """Retrieves a string value from a Redis data storage.
@@ -169,7 +1725,7 @@ class Cache:
             str: The retrieved data decoded as a string,
             or None if the key doesn't exist.
         """
-        return self.get(key, lambda x: x.decode("utf-8"))
+        return self.get(key, _to_str)
 
     def get_int(self, key: str) -> int:
         """Retrieves an integer value from a Redis data storage.
@@ -181,4 +1737,392 @@ class Cache:
             int: The retrieved data converted to an integer,
             or None if the key doesn't exist.
         """
-        return self.get(key, lambda x: int(x))
+        return self.get(key, int)
+
+    def store_many(
+        self,
+        values: Iterable[Union[str, bytes, int, float]],
+        batch_size: int = None,
+        ttl: float = None,
+    ) -> List[str]:
+        """Stores a batch of values in a Redis data storage.
+        Each chunk is written with a single MSET, and the call
+        count and history of Cache.store are updated in the same
+        pipeline as if every value had been stored on its own.
+        With the stream history backend, the entries of a chunk
+        are added once it is written, each with its share of the
+        chunk's duration, in one more round trip.
+
+        Args:
+            values (Iterable[Union[str, bytes, int, float]]):
+                The values to store.
+            batch_size (int): The number of values per round trip,
+            defaults to the batch size of the Cache.
+            ttl (float): The seconds before the values expire,
+            defaults to the ttl of the Cache. MSET cannot set an
+            expiry, so expiring values are written with one SET each.
+
+        Returns:
+            List[str]: The keys generated for the values, in order.
+        """
+        method_name = _prefixed(self, Cache.store.__qualname__)
+        key_input = f"{method_name}:inputs"
+        key_output = f"{method_name}:outputs"
+        key_stream = f"{method_name}:history"
+        instrumented = isinstance(self._redis, redis.Redis)
+        streamed = instrumented and self._history_backend == "stream"
+        keys = []
+        for chunk in _chunks(values, batch_size or self._batch_size):
+            payloads = [self._encode(value) for value in chunk]
+            if self._content_addressed:
+                chunk_keys = [self._new_key(payload) for payload in payloads]
+            else:
+                chunk_keys = _new_keys(len(chunk))
+            sampled = []
+            if instrumented:
+                sampled = [
+                    (value, key)
+                    for value, key in zip(chunk, chunk_keys)
+                    if _sampled(self)
+                ]
+            started = time.time()
+            clock = time.perf_counter()
+            pipe = self._redis.pipeline(transaction=self._transaction)
+            if self._content_addressed or self._expiry(ttl):
+                for key, payload in zip(chunk_keys, payloads):
+                    self._write(pipe, _prefixed(self, key), payload, ttl)
+            else:
+                pipe.mset({
+                    _prefixed(self, key): payload
+                    for key, payload in zip(chunk_keys, payloads)
+                })
+            if instrumented and self._counter is not None:
+                self._counter.add(method_name, len(chunk))
+            elif instrumented:
+                pipe.incrby(method_name, len(chunk))
+            if sampled and not streamed:
+                inputs = [str((value,)) for value, _ in sampled]
+                outputs = [key for _, key in sampled]
+                _push_history(self, pipe, key_input, *inputs)
+                _push_history(self, pipe, key_output, *outputs)
+            pipe.execute()
+            if sampled and streamed:
+                duration = (time.perf_counter() - clock) / len(chunk)
+                pipe = self._redis.pipeline(transaction=False)
+                for value, key in sampled:
+                    _add_history_entry(
+                        self, pipe, key_stream, (value,), key, "",
+                        started, duration
+                        )
+                pipe.execute()
+            keys.extend(chunk_keys)
+        return keys
+
+    def get_many(
+        self,
+        keys: Iterable[str],
+        fn: Callable = None,
+        batch_size: int = None,
+    ) -> List[Union[str, bytes, int, float]]:
+        """Retrieves a batch of values from a Redis data storage.
+
+        Args:
+            keys (Iterable[str]): The Redis keys for the data.
+            fn (Optional[Callable]): A function to apply
+            to each retrieved value for conversion.
+            batch_size (int): The number of keys per MGET,
+            defaults to the batch size of the Cache.
+
+        Returns:
+            List[Union[str, bytes, int, float]]:
+            The retrieved values in the order of the keys,
+            with None for keys that don't exist.
+        """
+        self.flush_batch()
+        values = []
+        for chunk in _chunks(keys, batch_size or self._batch_size):
+            chunk = [_prefixed(self, key) for key in chunk]
+            if self._sliding and self._ttl is not None:
+                pipe = self._redis.pipeline(transaction=False)
+                for key in chunk:
+                    self._read(pipe, key)
+                found = pipe.execute()
+            else:
+                found = self._redis.mget(chunk)
+            values.extend(
+                self._convert(data, fn) if data is not None else None
+                for data in found
+                )
+        return values
+
+    @track_latency
+    def store_stream(
+        self,
+        data: Any,
+        chunk_size: int = _CHUNK_SIZE,
+        ttl: float = None,
+    ) -> str:
+        """Stores a large value one chunk at a time and returns the key.
+        The first chunk is written with SET and the others are
+        appended to it with APPEND, one round trip each. Chunks of a
+        bytes-like value are memoryview slices of it, which are sent
+        as they are, so the value is never copied; a file is read
+        into one reused chunk buffer. Either way, the memory used
+        is one chunk whatever the size of the value, up to the
+        512 MB Redis allows for a string.
+
+        The value is stored as raw bytes, without the codec of the
+        Cache, and the call is neither counted nor kept in the call
+        history, which would hold the whole value; only its latency
+        is recorded, when the Cache tracks latency. Read the value
+        back with get_into.
+
+        Args:
+            data: A bytes-like object, such as bytes, bytearray or
+            memoryview, or a binary file opened for reading.
+            chunk_size (int): The number of bytes sent per round trip.
+            ttl (float): The seconds before the value expires,
+            defaults to the ttl of the Cache.
+
+        Returns:
+            str: A unique key generated
+            for the stored data.
+        """
+        data_key = str(uuid.uuid4())
+        key = _prefixed(self, data_key)
+        if hasattr(data, "readinto"):
+            buffer = bytearray(chunk_size)
+            view = memoryview(buffer)
+            chunks = (
+                view[:size]
+                for size in iter(lambda: data.readinto(buffer), 0)
+            )
+        else:
+            view = memoryview(data).cast("B")
+            chunks = (
+                view[offset:offset + chunk_size]
+                for offset in range(0, len(view), chunk_size)
+            )
+        self._redis.set(key, next(chunks, b""), **self._expiry(ttl))
+        for chunk in chunks:
+            self._redis.append(key, chunk)
+        return data_key
+
+    def get_into(
+        self,
+        key: str,
+        out: Any,
+        chunk_size: int = _CHUNK_SIZE,
+    ) -> int:
+        """Reads a value into a buffer or file one chunk at a time,
+        with GETRANGE, so only one chunk is held in memory.
+
+        Args:
+            key (str): The Redis key for the data.
+            out: A writable bytes-like object, such as a bytearray,
+            at least as long as the value, or a binary file opened
+            for writing.
+            chunk_size (int): The number of bytes read per round trip.
+
+        Returns:
+            int: The length of the value, or None if the key
+            doesn't exist.
+
+        Raises:
+            ValueError: If out is a buffer too small for the value.
+        """
+        self.flush_batch()
+        key = _prefixed(self, key)
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.exists(key)
+        pipe.strlen(key)
+        pipe.getrange(key, 0, chunk_size - 1)
+        exists, size, chunk = pipe.execute()
+        if not exists:
+            return None
+        if hasattr(out, "write"):
+            write = out.write
+        else:
+            view = memoryview(out).cast("B")
+            if len(view) < size:
+                raise ValueError(
+                    f"get_into needs a buffer of {size} bytes, "
+                    f"got {len(view)}")
+
+            def write(chunk: bytes) -> None:
+                view[offset:offset + len(chunk)] = chunk
+
+        offset = 0
+        while True:
+            write(chunk)
+            offset += len(chunk)
+            if offset >= size or not chunk:
+                return offset
+            chunk = self._redis.getrange(
+                key, offset, offset + chunk_size - 1)
+
+    def release(self, key: str) -> int:
+        """Drops one reference to a content addressed value.
+        The value and its counter are deleted atomically, by a
+        server-side script, when the last reference is dropped.
+
+        Args:
+            key (str): The key returned by store.
+
+        Returns:
+            int: The number of references left, 0 once the value is
+            deleted or if the value has no reference counter, in
+            which case it is left in place.
+
+        Raises:
+            ValueError: If the Cache does not count references.
+        """
+        if not (self._content_addressed and self._refcount):
+            raise ValueError(
+                "release needs a content addressed Cache with refcount")
+        if self._release_script is None:
+            self._release_script = self._redis.register_script(
+                "if redis.call('EXISTS', KEYS[2]) == 0 then return 0 end "
+                "local refs = redis.call('DECR', KEYS[2]) "
+                "if refs <= 0 then redis.call('DEL', KEYS[1], KEYS[2]) end "
+                "return refs"
+            )
+        self.flush_batch()
+        key = _prefixed(self, key)
+        refs = self._release_script(keys=[key, f"{key}:refs"])
+        if refs <= 0 and self._near_cache is not None:
+            self._near_cache.invalidate(key)
+        return max(refs, 0)
+
+    def _increment(self, name: str) -> None:
+        """Increments a counter, buffered in-process."""
+        self._memo_counter.add(_prefixed(self, name))
+
+    def memoize(
+        self,
+        ttl: float = None,
+        key_fn: Callable = None,
+        beta: float = 1.0,
+        lock_timeout: float = 10.0,
+        codec: Any = None,
+    ) -> Callable:
+        """Caches the results of a function in Redis.
+
+        The arguments are hashed into the key
+        memoize:<qualname>:<digest>. On a hit the stored result is
+        returned; on a miss one caller takes a lock and computes it
+        while the others wait for its result, so an expired key is
+        only recomputed once. With a ttl, a hit may also refresh the
+        key early, with a probability that grows as the expiry gets
+        closer and with the time the function took (XFetch), so hot
+        keys are refreshed before they expire. Hits and misses are
+        counted in <qualname>:hits and <qualname>:misses, buffered
+        in-process like the call counts, so a hit is one round trip.
+
+        Results are encoded with the codec of the Cache, or with the
+        struct codec, which also packs the ObjectIds and datetimes of
+        MongoDB documents. Pickle has to be asked for, since unpickling
+        runs whatever code the writer of the key chose.
+
+            @cache.memoize(ttl=60)
+            def top_students(mongo_collection):
+                ...
+
+        Args:
+            ttl (float): The seconds a result stays cached,
+            or None to keep it until it is evicted.
+            key_fn (Callable): Builds the key material from the
+            arguments, instead of their repr.
+            beta (float): Scales early refreshes; 0 disables them.
+            lock_timeout (float): The seconds the recompute lock
+            is held, and waited for, at most.
+            codec: A codec name from serialization.CODECS, or a
+            codec instance, for the results, such as "pickle" for
+            results struct cannot encode.
+
+        Returns:
+            Callable: The decorator.
+        """
+        if codec is not None:
+            codec = get_codec(codec)
+        else:
+            codec = self._codec or get_codec("struct")
+
+        def decorator(fn: Callable) -> Callable:
+            """Wraps fn with read-through caching."""
+            name = fn.__qualname__
+
+            def cache_key(args: tuple, kwargs: dict) -> str:
+                """Hashes the arguments of a call into its key."""
+                if key_fn is not None:
+                    material = key_fn(*args, **kwargs)
+                else:
+                    material = (args, sorted(kwargs.items()))
+                digest = hashlib.blake2b(
+                    repr(material).encode(), digest_size=16).hexdigest()
+                return _prefixed(self, f"memoize:{name}:{digest}")
+
+            def load(key: str) -> Tuple[Any, bool]:
+                """Reads a cached result.
+
+                Returns:
+                    Tuple[Any, bool]: The result, or _MISSING, and
+                    whether it should be refreshed early.
+                """
+                blob = self._redis.get(key)
+                if blob is None:
+                    return _MISSING, False
+                delta, expires = _MEMO_HEADER.unpack_from(blob)
+                value = codec.decode(blob[_MEMO_HEADER.size:])
+                refresh = ttl is not None and beta > 0 and (
+                    time.time() - delta * beta * math.log(random.random())
+                    >= expires)
+                return value, refresh
+
+            def compute(key: str, args: tuple, kwargs: dict) -> Any:
+                """Calls fn and stores its result with its cost."""
+                clock = time.perf_counter()
+                value = fn(*args, **kwargs)
+                delta = time.perf_counter() - clock
+                expires = math.inf if ttl is None else time.time() + ttl
+                blob = _MEMO_HEADER.pack(delta, expires) + codec.encode(value)
+                if ttl is None:
+                    self._redis.set(key, blob)
+                else:
+                    self._redis.set(key, blob, px=max(1, int(ttl * 1000)))
+                return value
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs) -> Any:
+                """Returns the cached result of fn, computing it once."""
+                key = cache_key(args, kwargs)
+                value, refresh = load(key)
+                if value is not _MISSING and not refresh:
+                    self._increment(f"{name}:hits")
+                    return value
+                lock = self._redis.lock(f"{key}:lock", timeout=lock_timeout)
+                if lock.acquire(blocking=False):
+                    try:
+                        self._increment(f"{name}:misses")
+                        return compute(key, args, kwargs)
+                    finally:
+                        try:
+                            lock.release()
+                        except redis.exceptions.LockError:
+                            pass
+                if value is not _MISSING:
+                    self._increment(f"{name}:hits")
+                    return value
+                deadline = time.monotonic() + lock_timeout
+                while time.monotonic() < deadline:
+                    time.sleep(0.01)
+                    value, _ = load(key)
+                    if value is not _MISSING:
+                        self._increment(f"{name}:hits")
+                        return value
+                self._increment(f"{name}:misses")
+                return compute(key, args, kwargs)
+
+            return wrapper
+
+        return decorator
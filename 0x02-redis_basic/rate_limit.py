@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""A module of rate limiters stored in Redis through a Cache.
+This module provides a SlidingWindowLimiter and a TokenBucketLimiter.
+Each check is a single Lua script, so it is atomic across processes
+and costs one round trip, however many keys it checks. The scripts
+read the clock of the Redis server, so clients with skewed clocks
+still share one limit. A key found over its limit is refused locally
+until the time the server said it may retry, with no round trip.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List
+from exercise import Cache, _prefixed
+
+_SLIDING_WINDOW = """
+local now = redis.call('TIME')
+local t = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local window = tonumber(ARGV[1])
+local cost = tonumber(ARGV[2])
+local index = math.floor(t / window)
+local elapsed = (t % window) / window
+local results = {}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 + i])
+    local state = redis.call('HMGET', key, 'index', 'current', 'previous')
+    local stored = tonumber(state[1])
+    local current, previous = 0, 0
+    if stored == index then
+        current, previous = tonumber(state[2]), tonumber(state[3])
+    elseif stored == index - 1 then
+        previous = tonumber(state[2])
+    end
+    local count = previous * (1 - elapsed) + current
+    if count + cost <= limit then
+        redis.call('HSET', key, 'index', index,
+                   'current', current + cost, 'previous', previous)
+        redis.call('PEXPIRE', key, window * 2)
+        results[i] = {1, math.floor(limit - count - cost), 0}
+    else
+        local wait = 1 - elapsed
+        if current + cost <= limit and previous > 0 then
+            wait = 1 - (limit - current - cost) / previous - elapsed
+        end
+        results[i] = {0, 0, math.max(1, math.ceil(wait * window))}
+    end
+end
+return results
+"""
+
+_TOKEN_BUCKET = """
+local now = redis.call('TIME')
+local t = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local rate = tonumber(ARGV[1]) / 1000
+local cost = tonumber(ARGV[2])
+local results = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 + i])
+    local state = redis.call('HMGET', key, 'tokens', 'time')
+    local tokens = tonumber(state[1]) or capacity
+    local last = tonumber(state[2]) or t
+    tokens = math.min(capacity, tokens + math.max(0, t - last) * rate)
+    if tokens >= cost then
+        tokens = tokens - cost
+        results[i] = {1, math.floor(tokens), 0}
+    else
+        results[i] = {0, 0, math.ceil((cost - tokens) / rate)}
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'time', t)
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate) + 1000)
+end
+return results
+"""
+
+
+class _Limiter:
+    """The checks shared by the rate limiters.
+    A subclass sets SCRIPT and passes its first argument.
+    """
+
+    SCRIPT = ""
+
+    def __init__(
+        self,
+        cache: Cache,
+        limit: int,
+        argument: float,
+        limits: Dict[str, int] = None,
+        name: str = "rate",
+    ) -> None:
+        """Initializes the limiter.
+
+        Args:
+            cache (Cache): The Cache whose Redis client and
+            namespace hold the limits.
+            limit (int): The limit of every key.
+            argument (float): The first argument of the script.
+            limits (Dict[str, int]): Limits of keys that differ
+            from limit.
+            name (str): The prefix of the Redis keys of the limiter,
+            so several limiters can share a Cache.
+        """
+        self.cache = cache
+        self.limit = limit
+        self.limits = limits or {}
+        self.name = name
+        self._argument = argument
+        self._script = cache._redis.register_script(self.SCRIPT)
+        self._blocked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: str, cost: int = 1) -> bool:
+        """Checks and counts one request for a key.
+
+        Args:
+            key (str): The key the limit applies to,
+            such as a user id or an IP address.
+            cost (int): The number of requests the call counts for.
+
+        Returns:
+            bool: True if the request is within the limit and was
+            counted, False if it must be refused.
+        """
+        return self.allow_many([key], cost)[0]
+
+    def allow_many(self, keys: Iterable[str], cost: int = 1) -> List[bool]:
+        """Checks and counts one request for each of several keys,
+        in one round trip, or none if every key is refused locally.
+
+        Args:
+            keys (Iterable[str]): The keys the limits apply to.
+            cost (int): The number of requests counted for each key.
+
+        Returns:
+            List[bool]: Whether the request of each key is allowed,
+            in the order of the keys.
+        """
+        keys = list(keys)
+        allowed = [False] * len(keys)
+        now = time.monotonic()
+        with self._lock:
+            pending = [
+                i for i, key in enumerate(keys)
+                if self._blocked.get(key, 0) <= now
+            ]
+        if not pending:
+            return allowed
+        results = self._script(
+            keys=[_prefixed(self.cache, f"{self.name}:{keys[i]}")
+                  for i in pending],
+            args=[self._argument, cost] + [
+                self.limits.get(keys[i], self.limit) for i in pending
+            ],
+        )
+        with self._lock:
+            for i, (ok, _, retry_ms) in zip(pending, results):
+                allowed[i] = bool(ok)
+                if ok:
+                    self._blocked.pop(keys[i], None)
+                else:
+                    self._blocked[keys[i]] = now + int(retry_ms) / 1000
+            if len(self._blocked) > 10000:
+                self._blocked = {
+                    key: until for key, until in self._blocked.items()
+                    if until > now
+                }
+        return allowed
+
+
+class SlidingWindowLimiter(_Limiter):
+    """Represents a sliding-window rate limiter:
+    at most limit requests per key in any window seconds.
+
+    The window is approximated from the counts of the current and
+    the previous fixed windows, weighted by how much of the previous
+    one still overlaps it, so each key holds a hash of two counters
+    and the index of the current window instead of one entry per
+    request.
+    """
+
+    SCRIPT = _SLIDING_WINDOW
+
+    def __init__(
+        self,
+        cache: Cache,
+        limit: int,
+        window: float,
+        limits: Dict[str, int] = None,
+        name: str = "rate",
+    ) -> None:
+        """Initializes the limiter.
+
+        Args:
+            cache (Cache): The Cache holding the counters.
+            limit (int): The requests allowed per window.
+            window (float): The length of the window in seconds.
+            limits (Dict[str, int]): Limits of keys that differ
+            from limit.
+            name (str): The prefix of the counter keys.
+        """
+        super().__init__(
+            cache, limit, max(1, int(window * 1000)), limits, name)
+        self.window = window
+
+
+class TokenBucketLimiter(_Limiter):
+    """Represents a token-bucket rate limiter:
+    each key has a bucket of limit tokens refilled at rate tokens
+    per second, and a request takes one token from it. Bursts of up
+    to limit requests are allowed after an idle period.
+    """
+
+    SCRIPT = _TOKEN_BUCKET
+
+    def __init__(
+        self,
+        cache: Cache,
+        limit: int,
+        rate: float,
+        limits: Dict[str, int] = None,
+        name: str = "bucket",
+    ) -> None:
+        """Initializes the limiter.
+
+        Args:
+            cache (Cache): The Cache holding the buckets.
+            limit (int): The capacity of a bucket.
+            rate (float): The tokens added to a bucket per second.
+            limits (Dict[str, int]): Capacities of keys that differ
+            from limit.
+            name (str): The prefix of the bucket keys.
+        """
+        super().__init__(cache, limit, rate, limits, name)
+        self.rate = rate
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""A module of codecs for the values stored by a Cache.
+Each codec turns a Python value into bytes that start with a
+one-byte type tag, so the value can be read back as its original
+type without a conversion function. A codec only decodes the tags
+it writes, so a Cache never unpickles data it did not expect.
+"""
+import json
+import pickle
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, Tuple
+
+try:
+    from bson import ObjectId
+except ImportError:
+    ObjectId = None
+
+_INT64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+_LENGTH = struct.Struct("<I")
+
+
+class RawCodec:
+    """Stores str, bytes, int and float values as Redis would,
+    prefixed with a tag for their type.
+    """
+
+    def encode(self, value: Any) -> bytes:
+        """Encodes a value.
+
+        Args:
+            value (Union[str, bytes, int, float]): The value to encode.
+
+        Returns:
+            bytes: The tagged value.
+        """
+        if isinstance(value, bytes):
+            return b"b" + value
+        if isinstance(value, str):
+            return b"s" + value.encode("utf-8")
+        if isinstance(value, bool):
+            raise TypeError("RawCodec cannot encode bool values")
+        if isinstance(value, int):
+            return b"i" + str(value).encode()
+        if isinstance(value, float):
+            return b"f" + repr(value).encode()
+        raise TypeError(f"RawCodec cannot encode {type(value).__name__}")
+
+    def decode(self, payload: bytes) -> Any:
+        """Decodes a value encoded by encode."""
+        tag, body = payload[:1], payload[1:]
+        if tag == b"b":
+            return bytes(body)
+        if tag == b"s":
+            return bytes(body).decode("utf-8")
+        if tag == b"i":
+            return int(body)
+        if tag == b"f":
+            return float(body)
+        raise ValueError(f"RawCodec cannot decode tag {tag!r}")
+
+
+class StructCodec:
+    """Packs values into a compact binary form in the spirit of
+    msgpack: None, bool, int, float, str, bytes, datetime, and
+    lists, tuples and dicts of them, plus the ObjectId of bson when
+    pymongo is installed, so MongoDB documents round-trip. Integers
+    that fit in 64 bits and floats take eight bytes; strings, bytes
+    and containers carry a 4-byte length.
+    """
+
+    def encode(self, value: Any) -> bytes:
+        """Encodes a value.
+
+        Args:
+            value: The value to encode.
+
+        Returns:
+            bytes: The packed value.
+        """
+        out = bytearray()
+        self._pack(value, out)
+        return bytes(out)
+
+    def _pack(self, value: Any, out: bytearray) -> None:
+        """Appends the packed form of a value to out."""
+        if value is None:
+            out += b"N"
+        elif value is True:
+            out += b"T"
+        elif value is False:
+            out += b"F"
+        elif isinstance(value, int):
+            if -2 ** 63 <= value < 2 ** 63:
+                out += b"i"
+                out += _INT64.pack(value)
+            else:
+                self._pack_sized(b"I", str(value).encode(), out)
+        elif isinstance(value, float):
+            out += b"d"
+            out += _DOUBLE.pack(value)
+        elif isinstance(value, str):
+            self._pack_sized(b"s", value.encode("utf-8"), out)
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            self._pack_sized(b"b", value, out)
+        elif isinstance(value, (list, tuple)):
+            out += b"l" if isinstance(value, list) else b"t"
+            out += _LENGTH.pack(len(value))
+            for item in value:
+                self._pack(item, out)
+        elif isinstance(value, dict):
+            out += b"m"
+            out += _LENGTH.pack(len(value))
+            for key, item in value.items():
+                self._pack(key, out)
+                self._pack(item, out)
+        elif isinstance(value, datetime):
+            self._pack_sized(b"D", value.isoformat().encode(), out)
+        elif ObjectId is not None and isinstance(value, ObjectId):
+            out += b"o"
+            out += value.binary
+        else:
+            raise TypeError(
+                f"StructCodec cannot encode {type(value).__name__}")
+
+    @staticmethod
+    def _pack_sized(tag: bytes, data: bytes, out: bytearray) -> None:
+        """Appends a tag, a length and the data to out."""
+        out += tag
+        out += _LENGTH.pack(len(data))
+        out += data
+
+    def decode(self, payload: bytes) -> Any:
+        """Decodes a value encoded by encode."""
+        value, end = self._unpack(memoryview(payload), 0)
+        if end != len(payload):
+            raise ValueError("StructCodec found trailing bytes")
+        return value
+
+    def _unpack(self, view: memoryview, pos: int) -> Tuple[Any, int]:
+        """Reads the value starting at pos.
+
+        Returns:
+            Tuple[Any, int]: The value and the position after it.
+        """
+        tag = bytes(view[pos:pos + 1])
+        pos += 1
+        if tag == b"N":
+            return None, pos
+        if tag == b"T":
+            return True, pos
+        if tag == b"F":
+            return False, pos
+        if tag == b"i":
+            return _INT64.unpack_from(view, pos)[0], pos + 8
+        if tag == b"d":
+            return _DOUBLE.unpack_from(view, pos)[0], pos + 8
+        if tag == b"o" and ObjectId is not None:
+            return ObjectId(bytes(view[pos:pos + 12])), pos + 12
+        if tag in (b"s", b"b", b"I", b"D"):
+            size = _LENGTH.unpack_from(view, pos)[0]
+            pos += 4
+            data = bytes(view[pos:pos + size])
+            if tag == b"s":
+                return data.decode("utf-8"), pos + size
+            if tag == b"I":
+                return int(data), pos + size
+            if tag == b"D":
+                return datetime.fromisoformat(data.decode()), pos + size
+            return data, pos + size
+        if tag in (b"l", b"t", b"m"):
+            count = _LENGTH.unpack_from(view, pos)[0]
+            pos += 4
+            items = []
+            for _ in range(count * 2 if tag == b"m" else count):
+                item, pos = self._unpack(view, pos)
+                items.append(item)
+            if tag == b"m":
+                return dict(zip(items[::2], items[1::2])), pos
+            return (items if tag == b"l" else tuple(items)), pos
+        raise ValueError(f"StructCodec cannot decode tag {tag!r}")
+
+
+class PickleCodec:
+    """Stores any picklable value. Only use it when every writer
+    to the Redis database is trusted, since unpickling runs code.
+    """
+
+    def encode(self, value: Any) -> bytes:
+        """Encodes a value with the highest pickle protocol."""
+        return b"p" + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, payload: bytes) -> Any:
+        """Decodes a value encoded by encode."""
+        if payload[:1] != b"p":
+            raise ValueError(f"PickleCodec cannot decode tag {payload[:1]!r}")
+        return pickle.loads(payload[1:])
+
+
+class JsonCodec:
+    """Stores JSON-serializable values as compact UTF-8 JSON.
+    Tuples are read back as lists. A bytes value, which JSON
+    cannot hold, is stored as is under its own tag.
+    """
+
+    def encode(self, value: Any) -> bytes:
+        """Encodes a value as JSON."""
+        if isinstance(value, bytes):
+            return b"B" + value
+        return b"j" + json.dumps(
+            value, separators=(",", ":"), ensure_ascii=False
+            ).encode("utf-8")
+
+    def decode(self, payload: bytes) -> Any:
+        """Decodes a value encoded by encode."""
+        tag = payload[:1]
+        if tag == b"B":
+            return payload[1:]
+        if tag != b"j":
+            raise ValueError(f"JsonCodec cannot decode tag {tag!r}")
+        return json.loads(payload[1:])
+
+
+class CompressedCodec:
+    """Wraps a codec and compresses its output with zlib
+    when it is at least threshold bytes long and compression
+    actually makes it smaller.
+    """
+
+    def __init__(self, codec: Any, threshold: int = 1024,
+                 level: int = 1) -> None:
+        """Initializes the wrapper.
+
+        Args:
+            codec: The codec whose output is compressed.
+            threshold (int): The smallest payload compressed.
+            level (int): The zlib compression level.
+        """
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+
+    def encode(self, value: Any) -> bytes:
+        """Encodes a value, compressing large payloads."""
+        payload = self.codec.encode(value)
+        if len(payload) >= self.threshold:
+            compressed = b"z" + zlib.compress(payload, self.level)
+            if len(compressed) < len(payload):
+                return compressed
+        return payload
+
+    def decode(self, payload: bytes) -> Any:
+        """Decodes a value encoded by encode."""
+        if payload[:1] == b"z":
+            payload = zlib.decompress(payload[1:])
+        return self.codec.decode(payload)
+
+
+CODECS = {
+    "raw": RawCodec,
+    "struct": StructCodec,
+    "pickle": PickleCodec,
+    "json": JsonCodec,
+}
+
+
+def get_codec(codec: Any, compress_threshold: int = None) -> Any:
+    """Builds the codec a Cache uses.
+
+    Args:
+        codec: A codec name from CODECS, or a codec instance.
+        compress_threshold (int): Compress payloads of at least
+        this many bytes, or never if None.
+
+    Returns:
+        The codec, wrapped in a CompressedCodec if needed.
+    """
+    if isinstance(codec, str):
+        codec = CODECS[codec]()
+    if compress_threshold is not None:
+        codec = CompressedCodec(codec, compress_threshold)
+    return codec
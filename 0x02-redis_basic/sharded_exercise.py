@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""A module for spreading a Cache over several Redis nodes.
+This module provides a ShardedCache class with the interface of
+exercise.Cache that places each key on one of N Redis endpoints
+with a consistent-hash ring, so adding a node only moves about
+1/N of the keys. Batch operations are split per node and the
+per-node requests run in parallel.
+"""
+import hashlib
+import uuid
+import redis
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Sequence, Union
+from exercise import _chunks, _new_keys, _to_str, call_history, count_calls
+
+
+def _hash(value: str) -> int:
+    """Hashes a string onto the ring."""
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _node_name(client: redis.Redis) -> str:
+    """Names a client by the endpoint it connects to."""
+    kwargs = client.connection_pool.connection_kwargs
+    if "path" in kwargs:
+        return f"{kwargs['path']}/{kwargs.get('db', 0)}"
+    return (f"{kwargs.get('host', 'localhost')}:{kwargs.get('port', 6379)}"
+            f"/{kwargs.get('db', 0)}")
+
+
+class HashRing:
+    """Represents a consistent-hash ring of named nodes.
+    Each node is placed at replicas points of the ring, and a key
+    belongs to the first node point at or after its own hash.
+    """
+
+    def __init__(self, nodes: Sequence[str], replicas: int = 160) -> None:
+        """Initializes the ring.
+
+        Args:
+            nodes (Sequence[str]): The names of the nodes.
+            replicas (int): The points per node; more points
+            spread the keys more evenly.
+        """
+        points = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in nodes
+            for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: str) -> str:
+        """Returns the name of the node a key belongs to."""
+        i = bisect(self._hashes, _hash(key))
+        return self._nodes[i % len(self._nodes)]
+
+
+class ShardedCache:
+    """Represents an object
+    for storing data across several Redis data storages.
+
+    Methods:
+        store(data: Union[str, bytes, int, float]) -> str:
+            Stores data on the node of a new unique key.
+
+        get(key: str, fn: Optional[Callable] = None) ->
+        Union[str, bytes, int, float, None]:
+            Retrieves data from the node of the key.
+
+        get_str(key: str) -> Optional[str]:
+            Retrieves the data as a UTF-8 decoded string.
+
+        get_int(key: str) -> Optional[int]:
+            Retrieves the data as an integer.
+
+        store_many(values: Iterable) -> List[str]:
+            Stores a batch of values, the nodes in parallel.
+
+        get_many(keys: Iterable[str], fn: Optional[Callable] = None)
+        -> List:
+            Retrieves a batch of values, the nodes in parallel.
+
+    The call counts and histories of count_calls and call_history
+    are pinned to one node, so replay works unchanged.
+    """
+
+    def __init__(
+        self,
+        nodes: Sequence[Union[str, redis.Redis]],
+        history_node: int = 0,
+        replicas: int = 160,
+        batch_size: int = 1000,
+    ) -> None:
+        """Initializes a ShardedCache instance.
+
+        Args:
+            nodes (Sequence[Union[str, redis.Redis]]): The Redis
+            nodes, as clients or redis:// URLs. A node is placed on
+            the ring by its host, port and database, so the same
+            endpoints always shard keys the same way.
+            history_node (int): The index of the node that keeps
+            the call counts and histories.
+            replicas (int): The ring points per node.
+            batch_size (int): The number of values sent per
+            round trip by store_many and get_many.
+        """
+        clients = [
+            redis.Redis.from_url(node) if isinstance(node, str) else node
+            for node in nodes
+        ]
+        self._nodes: Dict[str, redis.Redis] = {}
+        for client in clients:
+            self._nodes[_node_name(client)] = client
+        if len(self._nodes) != len(clients):
+            raise ValueError("ShardedCache nodes must be distinct")
+        self._ring = HashRing(list(self._nodes), replicas)
+        self._redis = clients[history_node]
+        self._batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=len(clients))
+
+    def node(self, key: str) -> redis.Redis:
+        """Returns the client of the node a key belongs to."""
+        return self._nodes[self._ring.node(key)]
+
+    def _by_node(self, keys: Iterable[str]) -> Dict[str, List[int]]:
+        """Groups the positions of keys by the node they belong to."""
+        groups: Dict[str, List[int]] = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(self._ring.node(key), []).append(i)
+        return groups
+
+    @count_calls
+    @call_history
+    def store(self, data: Union[str, bytes, int, float]) -> str:
+        """Stores a value on the node of a new key and returns the key.
+
+        Args:
+            data (Union[str, bytes, int, float]):
+                The data to store in Redis.
+                Can be a string, bytes, int, or float.
+
+        Returns:
+            str: A unique key generated
+            for the stored data.
+        """
+        data_key = str(uuid.uuid4())
+        self.node(data_key).set(data_key, data)
+        return data_key
+
+    def get(
+        self,
+        key: str,
+        fn: Callable = None,
+    ) -> Union[str, bytes, int, float]:
+        """Retrieves a value from the node of its key.
+
+        Args:
+            key (str): The Redis key for the data.
+            fn (Optional[Callable]): A function to apply
+            to the retrieved data for conversion.
+
+        Returns:
+            Union[str, bytes, int, float]:
+            The retrieved data, optionally converted
+            by the provided function,
+            or None if the key doesn't exist.
+        """
+        data = self.node(key).get(key)
+        return fn(data) if fn is not None else data
+
+    def get_str(self, key: str) -> str:
+        """Retrieves a string value from the node of its key."""
+        return self.get(key, _to_str)
+
+    def get_int(self, key: str) -> int:
+        """Retrieves an integer value from the node of its key."""
+        return self.get(key, int)
+
+    def store_many(
+        self,
+        values: Iterable[Union[str, bytes, int, float]],
+        batch_size: int = None,
+    ) -> List[str]:
+        """Stores a batch of values across the nodes.
+        Each chunk is split per node and written with one MSET
+        per node, in parallel; the call count and history of
+        ShardedCache.store are then updated on the history node.
+
+        Args:
+            values (Iterable[Union[str, bytes, int, float]]):
+                The values to store.
+            batch_size (int): The number of values per chunk,
+            defaults to the batch size of the ShardedCache.
+
+        Returns:
+            List[str]: The keys generated for the values, in order.
+        """
+        method_name = ShardedCache.store.__qualname__
+        keys = []
+        for chunk in _chunks(values, batch_size or self._batch_size):
+            chunk_keys = _new_keys(len(chunk))
+            writes = [
+                self._executor.submit(
+                    self._nodes[node].mset,
+                    {chunk_keys[i]: chunk[i] for i in positions})
+                for node, positions in self._by_node(chunk_keys).items()
+            ]
+            for write in writes:
+                write.result()
+            if isinstance(self._redis, redis.Redis):
+                pipe = self._redis.pipeline()
+                pipe.incrby(method_name, len(chunk))
+                pipe.rpush(f"{method_name}:inputs",
+                           *(str((value,)) for value in chunk))
+                pipe.rpush(f"{method_name}:outputs", *chunk_keys)
+                pipe.execute()
+            keys.extend(chunk_keys)
+        return keys
+
+    def get_many(
+        self,
+        keys: Iterable[str],
+        fn: Callable = None,
+        batch_size: int = None,
+    ) -> List[Union[str, bytes, int, float]]:
+        """Retrieves a batch of values across the nodes.
+        Each chunk is split per node and read with one MGET
+        per node, in parallel.
+
+        Args:
+            keys (Iterable[str]): The Redis keys for the data.
+            fn (Optional[Callable]): A function to apply
+            to each retrieved value for conversion.
+            batch_size (int): The number of keys per chunk,
+            defaults to the batch size of the ShardedCache.
+
+        Returns:
+            List[Union[str, bytes, int, float]]:
+            The retrieved values in the order of the keys,
+            with None for keys that don't exist.
+        """
+        values = []
+        for chunk in _chunks(keys, batch_size or self._batch_size):
+            found = [None] * len(chunk)
+            reads = {
+                self._executor.submit(
+                    self._nodes[node].mget, [chunk[i] for i in positions]
+                ): positions
+                for node, positions in self._by_node(chunk).items()
+            }
+            for read, positions in reads.items():
+                for i, data in zip(positions, read.result()):
+                    found[i] = data
+            values.extend(
+                fn(data) if fn is not None and data is not None else data
+                for data in found
+                )
+        return values
+
+    def close(self) -> None:
+        """Stops the worker threads of the batch operations."""
+        self._executor.shutdown()
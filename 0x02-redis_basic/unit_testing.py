@@ -1,7 +1,31 @@
 #!/usr/bin/env python3
-from exercise import Cache
+import asyncio
+import exercise
+from exercise import Cache, LatencyHistogram, NearCache, history
+from exercise import stream_history
+from async_exercise import AsyncCache
+from serialization import CODECS, get_codec
+from sharded_exercise import HashRing, ShardedCache
+from rate_limit import SlidingWindowLimiter, TokenBucketLimiter
+import fakeredis
+import importlib.util
+import mongomock
+import os
+import redis
+import redis.asyncio
+import socketserver
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from bson import ObjectId
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+_spec = importlib.util.spec_from_file_location("students", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "0x01-NoSQL", "101-students.py"))
+students_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(students_module)
 
 class TestCache(unittest.TestCase):
     """
@@ -73,9 +97,1215 @@ class TestCache(unittest.TestCase):
 
     def test_redis_flush_on_init(self):
         """
-        Test that Redis database is flushed upon Cache initialization.
+        Test that Redis database is only flushed upon Cache
+        initialization when asked to.
         """
+        self.mock_redis.flushdb.assert_not_called()
+        Cache(client=self.mock_redis, flush=True)
         self.mock_redis.flushdb.assert_called_once()
 
+    def test_shared_pool(self):
+        """
+        Test that Caches share one connection pool by default.
+        """
+        with patch('redis.Redis') as MockRedis:
+            Cache()
+            Cache()
+        pools = {id(call[1]["connection_pool"])
+                 for call in MockRedis.call_args_list}
+        self.assertEqual(len(pools), 1)
+
+    def test_namespace(self):
+        """
+        Test that a namespace prefixes the keys sent to Redis.
+        """
+        cache = Cache(client=self.mock_redis, namespace="app")
+        key = cache.store("test_data")
+        self.mock_redis.set.assert_called_once_with(
+            f"app:{key}", "test_data")
+        self.mock_redis.get.return_value = b"test_data"
+        cache.get_str(key)
+        self.mock_redis.get.assert_called_once_with(f"app:{key}")
+
+
+class TrackingServer(socketserver.ThreadingTCPServer):
+    """
+    A stand-in for a RESP2-only Redis server that accepts client-side
+    caching requests and can push invalidations to the listener.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), TrackingHandler)
+        self.port = self.server_address[1]
+        self.tracking = None
+        self.listener = None
+        self.subscribed = threading.Event()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def invalidate(self, *keys):
+        """
+        Pushes an invalidation message of keys to the listener.
+        """
+        message = b"*3\r\n$7\r\nmessage\r\n$20\r\n__redis__:invalidate\r\n"
+        message += b"*%d\r\n" % len(keys)
+        for key in keys:
+            message += b"$%d\r\n%s\r\n" % (len(key), key)
+        self.listener.wfile.write(message)
+
+
+class TrackingHandler(socketserver.StreamRequestHandler):
+    """
+    Answers the commands of one connection to a TrackingServer.
+    """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            command = b" ".join(args[:2]).upper()
+            if command.startswith(b"HELLO"):
+                reply = b"-ERR unknown command 'HELLO'\r\n"
+            elif command == b"CLIENT ID":
+                reply = b":7\r\n"
+            elif command.startswith(b"SUBSCRIBE"):
+                reply = (b"*3\r\n$9\r\nsubscribe\r\n"
+                         b"$20\r\n__redis__:invalidate\r\n:1\r\n")
+                self.server.listener = self
+            else:
+                reply = b"+OK\r\n"
+            if command == b"CLIENT TRACKING":
+                self.server.tracking = args
+            self.wfile.write(reply)
+            if self.server.listener is self:
+                self.server.subscribed.set()
+
+
+class TestNearCache(unittest.TestCase):
+    """
+    Unit tests for reading through a NearCache.
+    """
+
+    @patch('redis.Redis')
+    def setUp(self, MockRedis):
+        """
+        Set up a Cache with a two-key NearCache over a mocked Redis.
+        """
+        self.mock_redis = MockRedis.return_value
+        self.near_cache = NearCache(maxsize=2)
+        self.cache = Cache(near_cache=self.near_cache)
+
+    def test_repeated_get_int_is_served_from_memory(self):
+        """
+        Test that the converted value is cached after the first read.
+        """
+        self.mock_redis.get.return_value = b"123"
+        self.assertEqual(self.cache.get_int("k"), 123)
+        self.assertEqual(self.cache.get_int("k"), 123)
+        self.mock_redis.get.assert_called_once_with("k")
+        self.assertEqual(self.near_cache.hits, 1)
+        self.assertEqual(self.near_cache.misses, 1)
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used key is evicted first.
+        """
+        self.mock_redis.get.return_value = b"1"
+        for key in ("a", "b", "a", "c"):
+            self.cache.get(key)
+        self.cache.get("a")
+        self.cache.get("b")
+        self.assertEqual(self.mock_redis.get.call_count, 4)
+
+    def test_invalidation(self):
+        """
+        Test that an invalidated key is read from Redis again.
+        """
+        self.mock_redis.get.return_value = b"1"
+        self.cache.get("k")
+        self.near_cache.invalidate(b"k")
+        self.cache.get("k")
+        self.assertEqual(self.mock_redis.get.call_count, 2)
+
+    def test_entries_expire_with_their_key(self):
+        """
+        Test that a NearCache without a ttl does not serve a value
+        after the ttl of the Cache expired it in Redis.
+        """
+        near_cache = NearCache()
+        cache = Cache(client=fakeredis.FakeRedis(), ttl=1,
+                      near_cache=near_cache)
+        key = cache.store("a")
+        self.assertEqual(cache.get_str(key), "a")
+        self.assertEqual(cache.get_str(key), "a")
+        self.assertEqual(near_cache.hits, 1)
+        later = time.monotonic() + 1
+        with patch.object(exercise.time, "monotonic", return_value=later):
+            self.assertIs(near_cache.get(key, exercise._to_str), exercise._MISSING)
+
+    def test_missing_keys_are_not_cached(self):
+        """
+        Test that a None result is not cached.
+        """
+        self.mock_redis.get.return_value = None
+        self.cache.get("k")
+        self.cache.get("k")
+        self.assertEqual(self.mock_redis.get.call_count, 2)
+
+    def test_invalidation_discards_reads_of_its_key(self):
+        """
+        Test that a read in flight is only discarded by an
+        invalidation of its own key.
+        """
+        token = self.near_cache.token()
+        self.near_cache.invalidate("Cache.store")
+        self.near_cache.put("a", None, b"1", token)
+        self.near_cache.invalidate("b")
+        self.near_cache.put("b", None, b"2", token)
+        self.assertEqual(self.near_cache.get("a"), b"1")
+        self.assertIs(self.near_cache.get("b"), exercise._MISSING)
+
+    def test_other_conversions_are_not_cached(self):
+        """
+        Test that only the results of get, get_str and get_int
+        are cached, so the entry of a key stays bounded.
+        """
+        self.mock_redis.get.return_value = b"1"
+        self.cache.get("k", float)
+        self.cache.get("k", float)
+        self.assertEqual(self.mock_redis.get.call_count, 2)
+
+    def test_track(self):
+        """
+        Test that track enables broadcast tracking on a listener
+        subscribed in RESP2, and applies the invalidations it gets.
+        """
+        server = TrackingServer()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        client = redis.Redis(port=server.port, socket_timeout=5)
+        for key in ("app:a", "app:b"):
+            self.near_cache.put(key, None, b"1", self.near_cache.token())
+        self.near_cache.track(client, "app:")
+        self.addCleanup(self.near_cache.close)
+        self.assertTrue(server.subscribed.wait(5))
+        self.assertEqual(server.tracking, [
+            b"CLIENT", b"TRACKING", b"ON", b"REDIRECT", b"7", b"BCAST",
+            b"PREFIX", b"app:"])
+        server.invalidate(b"app:a")
+        deadline = time.monotonic() + 5
+        while len(self.near_cache) > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIs(self.near_cache.get("app:a"), exercise._MISSING)
+        self.assertEqual(self.near_cache.get("app:b"), b"1")
+
+
+class TestCodecs(unittest.TestCase):
+    """
+    Unit tests for the value codecs of Cache.
+    """
+
+    def test_round_trip(self):
+        """
+        Test that every codec returns values with their original type.
+        """
+        values = ["héllo", b"\x00raw", 42, -2 ** 70, 2.5]
+        for name in CODECS:
+            for threshold in (None, 16):
+                codec = get_codec(name, threshold)
+                for value in values + ["x" * 100]:
+                    decoded = codec.decode(codec.encode(value))
+                    self.assertEqual(decoded, value)
+                    self.assertIs(type(decoded), type(value))
+
+    def test_struct_containers(self):
+        """
+        Test that the struct codec packs nested containers.
+        """
+        codec = get_codec("struct")
+        value = {"a": [1, None, True, (2.5, b"x")], 7: "seven"}
+        self.assertEqual(codec.decode(codec.encode(value)), value)
+
+    def test_struct_mongo_documents(self):
+        """
+        Test that the struct codec packs ObjectIds and datetimes.
+        """
+        codec = get_codec("struct")
+        value = [{"_id": ObjectId(), "at": datetime(2024, 5, 1, 12, 30),
+                  "utc": datetime(2024, 5, 1, tzinfo=timezone.utc)}]
+        self.assertEqual(codec.decode(codec.encode(value)), value)
+
+    def test_codec_rejects_foreign_tags(self):
+        """
+        Test that a codec does not decode another codec's payload.
+        """
+        payload = get_codec("pickle").encode([1])
+        with self.assertRaises(ValueError):
+            get_codec("json").decode(payload)
+
+    def test_cache_decodes_without_fn(self):
+        """
+        Test that a Cache with a codec stores tagged values
+        and get returns the original type.
+        """
+        with patch('redis.Redis') as MockRedis:
+            cache = Cache(codec="struct")
+        mock_redis = MockRedis.return_value
+        key = cache.store(123)
+        payload = mock_redis.set.call_args[0][1]
+        self.assertIsInstance(payload, bytes)
+        mock_redis.get.return_value = payload
+        self.assertEqual(cache.get(key), 123)
+        self.assertEqual(cache.get_str(key), "123")
+
+
+class TestContentAddressedCache(unittest.TestCase):
+    """
+    Unit tests for the content addressed store mode.
+    """
+
+    @patch('redis.Redis')
+    def setUp(self, MockRedis):
+        """
+        Set up a content addressed Cache over a mocked Redis instance.
+        """
+        self.mock_redis = MockRedis.return_value
+        self.cache = Cache(content_addressed=True)
+
+    def test_identical_values_share_a_key(self):
+        """
+        Test that equal values map to one key written with SET NX.
+        """
+        key = self.cache.store("test_data")
+        self.assertEqual(self.cache.store("test_data"), key)
+        self.assertNotEqual(self.cache.store("other_data"), key)
+        self.mock_redis.set.assert_any_call(key, "test_data", nx=True)
+
+    def test_refcount(self):
+        """
+        Test that references are counted in the same transaction.
+        """
+        self.cache._refcount = True
+        pipe = self.mock_redis.pipeline.return_value
+        key = self.cache.store("test_data")
+        pipe.set.assert_called_once_with(key, "test_data", nx=True)
+        pipe.incr.assert_called_once_with(f"{key}:refs")
+        pipe.execute.assert_called_once()
+
+    def test_release_needs_refcount(self):
+        """
+        Test that release refuses a Cache that does not count references.
+        """
+        with self.assertRaises(ValueError):
+            self.cache.release("key")
+        with self.assertRaises(ValueError):
+            Cache(client=self.mock_redis, refcount=True).release("key")
+
+    def test_release(self):
+        """
+        Test that the last release deletes the value, and that a value
+        without a reference counter is left in place.
+        """
+        client = fakeredis.FakeRedis()
+        cache = Cache(client=client, content_addressed=True, refcount=True)
+        key = cache.store("test_data")
+        cache.store("test_data")
+        self.assertEqual(cache.release(key), 1)
+        self.assertEqual(cache.get(key), b"test_data")
+        self.assertEqual(cache.release(key), 0)
+        self.assertIsNone(cache.get(key))
+        client.set("orphan", "value")
+        self.assertEqual(cache.release("orphan"), 0)
+        self.assertEqual(client.get("orphan"), b"value")
+
+
+class TestMemoize(unittest.TestCase):
+    """
+    Unit tests for the Cache.memoize decorator.
+    """
+
+    @patch('redis.Redis')
+    def setUp(self, MockRedis):
+        """
+        Set up a Cache over a mocked Redis instance.
+        """
+        self.mock_redis = MockRedis.return_value
+        self.cache = Cache()
+        self.calls = []
+
+        @self.cache.memoize(ttl=60, beta=0)
+        def square(x):
+            self.calls.append(x)
+            return x * x
+
+        self.square = square
+
+    def test_miss_then_hit(self):
+        """
+        Test that a result is computed once and then read back.
+        """
+        self.mock_redis.get.return_value = None
+        self.assertEqual(self.square(4), 16)
+        key, blob = self.mock_redis.set.call_args[0]
+        self.assertTrue(key.startswith("memoize:"))
+        self.assertEqual(self.mock_redis.set.call_args[1], {"px": 60000})
+        self.mock_redis.get.return_value = blob
+        self.assertEqual(self.square(4), 16)
+        self.assertEqual(self.calls, [4])
+        self.mock_redis.incr.assert_not_called()
+        self.cache._memo_counter.flush()
+        pipe = self.mock_redis.pipeline.return_value
+        pipe.incrby.assert_any_call(
+            f"{self.square.__qualname__}:misses", 1)
+        pipe.incrby.assert_any_call(
+            f"{self.square.__qualname__}:hits", 1)
+
+    def test_pickle_is_opt_in(self):
+        """
+        Test that results are encoded with struct unless pickle
+        is asked for.
+        """
+        self.mock_redis.get.return_value = None
+        self.square(4)
+        blob = self.mock_redis.set.call_args[0][1]
+        self.assertEqual(blob[16:], get_codec("struct").encode(16))
+        with self.assertRaises(TypeError):
+            self.cache.memoize()(object)()
+
+        @self.cache.memoize(codec="pickle")
+        def new_object():
+            return object()
+
+        new_object()
+        self.assertEqual(self.mock_redis.set.call_args[0][1][16:17], b"p")
+
+    def test_waits_for_the_lock_holder(self):
+        """
+        Test that a caller that misses the lock waits for the result.
+        """
+        self.mock_redis.get.return_value = None
+        self.square(3)
+        blob = self.mock_redis.set.call_args[0][1]
+        self.mock_redis.lock.return_value.acquire.return_value = False
+        self.mock_redis.get.side_effect = [None, None, blob]
+        self.assertEqual(self.square(3), 9)
+        self.assertEqual(self.calls, [3])
+
+    def test_memoize_top_students(self):
+        """
+        Test that the documents of 101-students.top_students,
+        ObjectIds included, are memoized with the default codec.
+        """
+        cache = Cache(client=fakeredis.FakeRedis())
+        students = mongomock.MongoClient().db.students
+        students.insert_many([
+            {"name": "Ann", "topics": [{"title": "C", "score": 4.0},
+                                       {"title": "Go", "score": 8.0}]},
+            {"name": "Bob", "topics": [{"title": "C", "score": 9.0}]},
+        ])
+        top_students = cache.memoize(ttl=60)(students_module.top_students)
+        expected = students_module.top_students(students)
+        self.assertEqual(top_students(students), expected)
+        with patch.object(students, "aggregate") as aggregate:
+            self.assertEqual(top_students(students), expected)
+        aggregate.assert_not_called()
+
+
+class TestExpiry(unittest.TestCase):
+    """
+    Unit tests for the ttl and sliding expiration of Cache.
+    """
+
+    @patch('redis.Redis')
+    def setUp(self, MockRedis):
+        """
+        Set up a Cache with a default ttl over a mocked Redis instance.
+        """
+        self.mock_redis = MockRedis.return_value
+        self.cache = Cache(ttl=30, sliding=True)
+
+    def test_store_sets_expiry_atomically(self):
+        """
+        Test that the ttl is part of the SET command.
+        """
+        key = self.cache.store("test_data")
+        self.mock_redis.set.assert_called_once_with(
+            key, "test_data", px=30000)
+        key = self.cache.store("test_data", ttl=0.5)
+        self.mock_redis.set.assert_called_with(key, "test_data", px=500)
+
+    def test_sliding_get_uses_getex(self):
+        """
+        Test that a sliding get refreshes the ttl with GETEX.
+        """
+        self.mock_redis.getex.return_value = b"123"
+        self.assertEqual(self.cache.get_int("test_key"), 123)
+        self.mock_redis.getex.assert_called_once_with("test_key", px=30000)
+        self.mock_redis.get.assert_not_called()
+
+
+class TestPipelinedCache(unittest.TestCase):
+    """
+    Unit tests for the pipelined instrumentation of Cache.store.
+    """
+
+    def setUp(self):
+        """
+        Set up a pipelined Cache over a mocked Redis instance.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.pipe = self.mock_redis.pipeline.return_value
+        self.cache = Cache(client=self.mock_redis, pipelined=True)
+
+    def test_store_single_round_trip(self):
+        """
+        Test that the counter, history and SET share one pipeline.
+        """
+        key = self.cache.store("test_data")
+        self.mock_redis.pipeline.assert_called_once_with(transaction=True)
+        self.pipe.incr.assert_called_once_with("Cache.store")
+        self.pipe.rpush.assert_any_call("Cache.store:inputs", "('test_data',)")
+        self.pipe.rpush.assert_any_call("Cache.store:outputs", key)
+        self.pipe.set.assert_called_once_with(key, "test_data")
+        self.pipe.execute.assert_called_once()
+        self.mock_redis.set.assert_not_called()
+        self.mock_redis.incr.assert_not_called()
+
+
+class TestCappedHistory(unittest.TestCase):
+    """
+    Unit tests for the capped and sampled call history.
+    """
+
+    def setUp(self):
+        """
+        Set up a Cache with a capped history over a mocked Redis.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.pipe = self.mock_redis.pipeline.return_value
+        self.cache = Cache(client=self.mock_redis, history_maxlen=100)
+
+    def test_history_is_trimmed_with_each_push(self):
+        """
+        Test that each RPUSH is followed by an LTRIM to the cap.
+        """
+        key = self.cache.store("test_data")
+        self.pipe.rpush.assert_any_call("Cache.store:inputs", "('test_data',)")
+        self.pipe.ltrim.assert_any_call("Cache.store:inputs", -100, -1)
+        self.pipe.rpush.assert_any_call("Cache.store:outputs", key)
+        self.pipe.ltrim.assert_any_call("Cache.store:outputs", -100, -1)
+        self.assertEqual(self.pipe.execute.call_count, 2)
+        self.mock_redis.incr.assert_called_once_with("Cache.store")
+
+    @patch('random.random', return_value=0.5)
+    def test_unsampled_calls_are_counted_only(self, mock_random):
+        """
+        Test that a call outside the sample skips the history.
+        """
+        self.cache._history_sample = 10
+        self.cache.store("test_data")
+        self.mock_redis.incr.assert_called_once_with("Cache.store")
+        self.mock_redis.pipeline.assert_not_called()
+        self.mock_redis.set.assert_called_once()
+
+
+class TestHistory(unittest.TestCase):
+    """
+    Unit tests for the paginated history generator.
+    """
+
+    def setUp(self):
+        """
+        Set up a Cache over a mocked Redis holding five calls.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.pipe = self.mock_redis.pipeline.return_value
+        self.cache = Cache(client=self.mock_redis)
+
+    def test_last_entries_read_in_pages(self):
+        """
+        Test that only the requested window is read, page by page.
+        """
+        self.pipe.execute.side_effect = [
+            [5, 5],
+            [[b"(2,)", b"(3,)"], [b"k2", b"k3"]],
+            [[b"(4,)"], [b"k4"]],
+        ]
+        entries = list(history(self.cache.store, last=3, page_size=2))
+        self.assertEqual(
+            entries, [("(2,)", "k2"), ("(3,)", "k3"), ("(4,)", "k4")])
+        self.pipe.lrange.assert_any_call("Cache.store:inputs", 2, 3)
+        self.pipe.lrange.assert_any_call("Cache.store:outputs", 4, 4)
+
+    def test_predicate(self):
+        """
+        Test that the predicate filters the yielded calls.
+        """
+        self.pipe.execute.side_effect = [
+            [2, 2],
+            [[b"(1,)", b"(2,)"], [b"k1", b"k2"]],
+        ]
+        entries = list(history(
+            self.cache.store, predicate=lambda ins, outs: outs == "k2"))
+        self.assertEqual(entries, [("(2,)", "k2")])
+
+
+class TestStreamHistory(unittest.TestCase):
+    """
+    Unit tests for the stream call history backend.
+    """
+
+    def setUp(self):
+        """
+        Set up a Cache with the stream backend over a mocked Redis.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.cache = Cache(client=self.mock_redis, history_backend="stream")
+
+    def test_store_adds_one_entry(self):
+        """
+        Test that a store adds one stream entry instead of two RPUSHes.
+        """
+        key = self.cache.store("test_data")
+        self.mock_redis.rpush.assert_not_called()
+        self.mock_redis.xadd.assert_called_once()
+        args, kwargs = self.mock_redis.xadd.call_args
+        self.assertEqual(args[0], "Cache.store:history")
+        self.assertEqual(args[1]["input"], "('test_data',)")
+        self.assertEqual(args[1]["output"], key)
+        self.assertEqual(args[1]["exception"], "")
+        self.assertGreaterEqual(args[1]["duration"], 0)
+
+    def test_exception_is_recorded(self):
+        """
+        Test that a call that raises is recorded with its exception.
+        """
+        self.mock_redis.set.side_effect = ValueError("boom")
+        with self.assertRaises(ValueError):
+            self.cache.store("test_data")
+        fields = self.mock_redis.xadd.call_args[0][1]
+        self.assertEqual(fields["output"], "")
+        self.assertIn("boom", fields["exception"])
+
+    def test_pipelined_exception_keeps_count_and_stream_in_step(self):
+        """
+        Test that a pipelined call that raises neither counts
+        nor records it.
+        """
+        client = fakeredis.FakeRedis()
+        cache = Cache(client=client, pipelined=True,
+                      history_backend="stream")
+        cache.store("a")
+        with patch.object(cache, "_encode", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                cache.store("b")
+        self.assertEqual(client.get("Cache.store"), b"1")
+        self.assertEqual(client.xlen("Cache.store:history"), 1)
+
+    def test_paging(self):
+        """
+        Test that offset and last select the same calls whether the
+        window is reached from the start or the end of the stream.
+        """
+        cache = Cache(client=fakeredis.FakeRedis(),
+                      history_backend="stream")
+        for i in range(10):
+            cache.store(i)
+        inputs = [f"({i},)" for i in range(10)]
+        for offset in range(11):
+            for last in (None, 0, 1, 4, 7, 12):
+                calls = stream_history(cache.store, last=last,
+                                       offset=offset, page_size=3)
+                expected = inputs[offset:]
+                if last is not None:
+                    expected = inputs[max(offset, 10 - last):]
+                self.assertEqual([call["input"] for call in calls],
+                                 expected)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    """
+    Unit tests for the latency histograms of Cache methods.
+    """
+
+    def setUp(self):
+        """
+        Set up a Cache tracking latency over a mocked Redis instance.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.pipe = self.mock_redis.pipeline.return_value
+        self.cache = Cache(client=self.mock_redis, latency=True)
+
+    def test_latency_is_opt_in(self):
+        """
+        Test that a default Cache records no latency.
+        """
+        cache = Cache(client=self.mock_redis)
+        self.assertIsNone(cache._latency)
+        cache.store("test_data")
+        self.pipe.hincrby.assert_not_called()
+
+    def test_caches_on_a_pool_share_histograms(self):
+        """
+        Test that Caches made per request on one connection pool
+        add their calls to one histogram, flushed in one round trip.
+        """
+        client = fakeredis.FakeRedis()
+        caches = [Cache(client=redis.Redis(
+            connection_pool=client.connection_pool), latency=True)
+            for _ in range(100)]
+        for cache in caches:
+            cache.store("test_data")
+        self.assertEqual(len({id(cache._latency) for cache in caches}), 1)
+        caches[0]._latency.flush()
+        self.assertEqual(
+            sum(LatencyHistogram.load(client, "Cache.store")), 100)
+
+    def test_calls_are_aggregated_until_flush(self):
+        """
+        Test that calls only reach Redis when the histogram flushes.
+        """
+        for _ in range(3):
+            self.cache.store("test_data")
+        self.mock_redis.hincrby.assert_not_called()
+        self.pipe.hincrby.assert_not_called()
+        self.cache._latency.flush(self.mock_redis)
+        self.assertEqual(
+            sum(call[0][2] for call in self.pipe.hincrby.call_args_list), 3)
+        self.pipe.execute.assert_called_once()
+
+    def test_failed_flush_keeps_calls(self):
+        """
+        Test that a flush that cannot reach Redis neither fails the
+        call that triggered it nor loses the recorded calls.
+        """
+        self.cache._latency.flush_interval = 0
+        self.pipe.execute.side_effect = redis.ConnectionError()
+        self.cache.store("test_data")
+        self.mock_redis.set.assert_called_once()
+        self.pipe.execute.side_effect = None
+        self.pipe.reset_mock()
+        self.cache._latency.flush(self.mock_redis)
+        self.assertEqual(
+            sum(call[0][2] for call in self.pipe.hincrby.call_args_list), 1)
+
+    def test_percentile(self):
+        """
+        Test that percentiles are interpolated inside their bucket.
+        """
+        counts = [0] * len(LatencyHistogram.BUCKETS)
+        counts[4] = 50
+        counts[5] = 50
+        self.assertAlmostEqual(LatencyHistogram.percentile(counts, 50), 1)
+        self.assertAlmostEqual(
+            LatencyHistogram.percentile(counts, 75), 1.75)
+
+
+class TestBufferedCounts(unittest.TestCase):
+    """
+    Unit tests for the buffered count_calls counters.
+    """
+
+    def setUp(self):
+        """
+        Set up a Cache with buffered counters over a mocked Redis.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.pipe = self.mock_redis.pipeline.return_value
+        self.cache = Cache(client=self.mock_redis,
+                           buffered_counts=True, count_flush_threshold=3)
+
+    def test_counts_flush_at_threshold(self):
+        """
+        Test that calls are counted locally and flushed with INCRBY.
+        """
+        self.cache.store("a")
+        self.cache.store("b")
+        self.mock_redis.incr.assert_not_called()
+        self.pipe.incrby.assert_not_called()
+        self.cache.store("c")
+        self.pipe.incrby.assert_called_once_with("Cache.store", 3)
+
+    def test_failed_flush_keeps_counts(self):
+        """
+        Test that counts survive a flush that cannot reach Redis.
+        """
+        self.cache._counter.add("Cache.store", 2)
+        self.pipe.execute.side_effect = redis.ConnectionError()
+        with self.assertRaises(redis.ConnectionError):
+            self.cache._counter.flush()
+        self.pipe.execute.side_effect = None
+        self.cache._counter.flush()
+        self.pipe.incrby.assert_called_with("Cache.store", 2)
+
+    def test_marks_dirty_once(self):
+        """
+        Test that a counter is handed to the flusher only when its
+        first pending call is counted.
+        """
+        with patch.object(exercise, "_mark_dirty") as mark_dirty:
+            self.cache.store("a")
+            self.cache.store("b")
+        mark_dirty.assert_called_once_with(self.cache._counter)
+
+    def test_counters_share_one_flusher_thread(self):
+        """
+        Test that many counters start one flusher thread, which
+        sends their counts and exits once none is pending.
+        """
+        caches = [Cache(client=self.mock_redis, buffered_counts=True,
+                        count_flush_interval=60) for _ in range(300)]
+        caches[0].store("a")
+        flusher = exercise._flusher
+        self.assertIsNotNone(flusher)
+        for cache in caches[1:]:
+            cache.store("a")
+        self.assertIs(exercise._flusher, flusher)
+        exercise._flush_at_exit()
+        flusher.join(5)
+        self.assertFalse(flusher.is_alive())
+        self.assertIsNone(exercise._flusher)
+        self.assertEqual(self.pipe.incrby.call_count, 300)
+
+
+class TestBatchCache(unittest.TestCase):
+    """
+    Unit tests for Cache.store_many and Cache.get_many.
+    """
+
+    def setUp(self):
+        """
+        Set up a Cache with small batches over a mocked Redis instance.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.pipe = self.mock_redis.pipeline.return_value
+        self.cache = Cache(client=self.mock_redis, batch_size=2)
+
+    def test_store_many_chunks(self):
+        """
+        Test that store_many sends one MSET and history per chunk.
+        """
+        keys = self.cache.store_many(["a", "b", "c"])
+        self.assertEqual(len(set(keys)), 3)
+        self.assertEqual(self.pipe.execute.call_count, 2)
+        self.pipe.mset.assert_any_call({keys[0]: "a", keys[1]: "b"})
+        self.pipe.mset.assert_any_call({keys[2]: "c"})
+        self.pipe.incrby.assert_any_call("Cache.store", 2)
+        self.pipe.rpush.assert_any_call(
+            "Cache.store:inputs", "('a',)", "('b',)")
+        self.pipe.rpush.assert_any_call("Cache.store:outputs", keys[2])
+
+    def test_get_many_with_conversion(self):
+        """
+        Test that get_many converts values and keeps missing keys None.
+        """
+        self.mock_redis.mget.side_effect = [[b"1", None], [b"3"]]
+        result = self.cache.get_many(["k1", "k2", "k3"], fn=int)
+        self.assertEqual(result, [1, None, 3])
+        self.mock_redis.mget.assert_any_call(["k1", "k2"])
+
+
+class TestStreamingCache(unittest.TestCase):
+    """
+    Unit tests for Cache.store_stream and Cache.get_into.
+    """
+
+    def setUp(self):
+        """
+        Set up a Cache over a mocked Redis instance.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.pipe = self.mock_redis.pipeline.return_value
+        self.cache = Cache(client=self.mock_redis)
+
+    def test_store_stream_sends_views(self):
+        """
+        Test that store_stream sends memoryview slices of the value.
+        """
+        data = bytearray(b"abcdefgh")
+        key = self.cache.store_stream(data, chunk_size=3)
+        self.mock_redis.set.assert_called_once_with(key, b"abc")
+        chunks = [c.args[1] for c in self.mock_redis.append.call_args_list]
+        self.assertEqual(chunks, [b"def", b"gh"])
+        self.assertTrue(all(isinstance(c, memoryview) for c in chunks))
+
+    def test_get_into_buffer(self):
+        """
+        Test that get_into fills the buffer one GETRANGE at a time.
+        """
+        self.pipe.execute.return_value = [1, 5, b"abc"]
+        self.mock_redis.getrange.return_value = b"de"
+        buffer = bytearray(5)
+        self.assertEqual(self.cache.get_into("k", buffer, chunk_size=3), 5)
+        self.assertEqual(buffer, b"abcde")
+        self.mock_redis.getrange.assert_called_once_with("k", 3, 5)
+
+    def test_get_into_missing_or_small(self):
+        """
+        Test that get_into returns None for a missing key and
+        rejects a buffer shorter than the value.
+        """
+        self.pipe.execute.return_value = [0, 0, b""]
+        self.assertIsNone(self.cache.get_into("k", bytearray()))
+        self.pipe.execute.return_value = [1, 5, b"abcde"]
+        with self.assertRaises(ValueError):
+            self.cache.get_into("k", bytearray(2))
+
+
+class FakePipeline(list):
+    """
+    A stand-in for a Redis pipeline that records command names.
+    """
+
+    sent = []
+
+    @property
+    def command_stack(self):
+        return self
+
+    def __getattr__(self, command):
+        return lambda *args, **kwargs: self.append(command)
+
+    def execute(self):
+        FakePipeline.sent.append(list(self))
+        self.clear()
+
+
+class TestAutoBatch(unittest.TestCase):
+    """
+    Unit tests for auto-batched Cache calls and fork safety.
+    """
+
+    def setUp(self):
+        """
+        Set up a Cache batching 8 commands per thread.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.mock_redis.pipeline.side_effect = lambda **kw: FakePipeline()
+        self.cache = Cache(client=self.mock_redis, autobatch=8,
+                           autobatch_interval=60)
+        FakePipeline.sent = []
+
+    def test_full_batch_is_sent(self):
+        """
+        Test that two stores, of four commands each, make one send.
+        """
+        self.cache.store("a")
+        self.assertEqual(FakePipeline.sent, [])
+        self.cache.store("b")
+        self.assertEqual(FakePipeline.sent,
+                         [["incr", "rpush", "set", "rpush"] * 2])
+
+    def test_read_sends_own_batch(self):
+        """
+        Test that get sends the batch of the thread before reading.
+        """
+        self.mock_redis.get.side_effect = \
+            lambda key: self.assertEqual(len(FakePipeline.sent), 1)
+        self.cache.get(self.cache.store("a"))
+        self.mock_redis.get.assert_called_once()
+
+    def test_batch_of_exited_thread_is_sent(self):
+        """
+        Test that the batch of a thread that has exited is sent
+        before it is forgotten.
+        """
+        worker = threading.Thread(target=self.cache.store, args=("a",))
+        worker.start()
+        worker.join()
+        self.cache._batcher._background_flush(False)
+        self.assertEqual(FakePipeline.sent,
+                         [["incr", "rpush", "set", "rpush"]])
+        self.assertEqual(self.cache._batcher._batches, [])
+        self.assertNotIn(self.cache._batcher, exercise._dirty)
+
+    def test_failed_background_send_is_counted(self):
+        """
+        Test that the commands of a failed background send are counted.
+        """
+        error = redis.ConnectionError()
+        with patch.object(FakePipeline, "execute", side_effect=error):
+            self.cache.store("a")
+            self.cache._batcher._background_flush(True)
+        self.assertEqual(self.cache._batcher.dropped, 4)
+        self.assertIs(self.cache._batcher.last_error, error)
+
+    def test_after_fork_replaces_pools(self):
+        """
+        Test that a fork gives Caches sharing a pool one new pool.
+        """
+        pool = redis.ConnectionPool(port=6390)
+        first = Cache(connection_pool=pool)
+        second = Cache(connection_pool=pool)
+        exercise._after_fork()
+        new = first._redis.connection_pool
+        self.assertIsNot(new, pool)
+        self.assertIs(second._redis.connection_pool, new)
+        self.assertEqual(new.connection_kwargs["port"], 6390)
+
+
+class TestScriptedStore(unittest.TestCase):
+    """
+    Unit tests for Cache.store run as a server-side script.
+    """
+
+    def setUp(self):
+        """
+        Set up a scripted Cache over a mocked Redis instance.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.script = self.mock_redis.register_script.return_value
+        self.pipe = self.mock_redis.pipeline.return_value
+        self.cache = Cache(client=self.mock_redis, scripted=True,
+                           history_maxlen=10)
+
+    def test_store_is_one_script_call(self):
+        """
+        Test that store loads the script once and makes one call each.
+        """
+        key = self.cache.store("a")
+        self.cache.store("b")
+        self.mock_redis.script_load.assert_called_once()
+        self.assertEqual(self.script.call_count, 2)
+        self.script.assert_any_call(
+            keys=["Cache.store", "Cache.store:inputs", key,
+                  "Cache.store:outputs"],
+            args=["('a',)", "a", "", 1, key, 10],
+            client=self.mock_redis)
+        self.mock_redis.incr.assert_not_called()
+        self.mock_redis.set.assert_not_called()
+
+    def test_inputs_match_call_history(self):
+        """
+        Test that the script records the inputs as call_history does.
+        """
+        self.cache.store("a", ttl=5)
+        self.cache.store("b", 5)
+        inputs = [call[1]["args"][0] for call in self.script.call_args_list]
+        self.assertEqual(inputs, ["('a',)", "('b', 5)"])
+
+    def test_fallback_pipeline(self):
+        """
+        Test that store sends a transaction when scripts are refused.
+        """
+        self.mock_redis.script_load.side_effect = \
+            redis.ResponseError("unknown command")
+        key = self.cache.store("a")
+        self.script.assert_not_called()
+        self.mock_redis.pipeline.assert_called_once_with(transaction=True)
+        self.pipe.incr.assert_called_once_with("Cache.store")
+        self.pipe.set.assert_called_once_with(key, "a")
+        self.pipe.rpush.assert_any_call("Cache.store:outputs", key)
+        self.pipe.execute.assert_called_once()
+
+    def test_rejects_stream_history(self):
+        """
+        Test that the script cannot be combined with stream history.
+        """
+        with self.assertRaises(ValueError):
+            Cache(client=self.mock_redis, scripted=True,
+                  history_backend="stream")
+
+
+class TestRateLimit(unittest.TestCase):
+    """
+    Unit tests for the rate limiters.
+    """
+
+    def setUp(self):
+        """
+        Set up limiters on a Cache over a mocked Redis instance.
+        """
+        self.mock_redis = MagicMock(spec=redis.Redis)
+        self.script = self.mock_redis.register_script.return_value
+        self.cache = Cache(client=self.mock_redis, namespace="app")
+
+    def test_allow_many_is_one_script_call(self):
+        """
+        Test that allow_many checks every key with per-key limits.
+        """
+        limiter = SlidingWindowLimiter(self.cache, 5, 1.5,
+                                       limits={"vip": 50})
+        self.script.return_value = [[1, 4, 0], [0, 0, 200]]
+        self.assertEqual(limiter.allow_many(["u", "vip"]), [True, False])
+        self.script.assert_called_once_with(
+            keys=["app:rate:u", "app:rate:vip"], args=[1500, 1, 5, 50])
+
+    def test_refused_key_is_not_sent(self):
+        """
+        Test that a refused key is refused locally until retry time.
+        """
+        limiter = TokenBucketLimiter(self.cache, 10, 2.0)
+        self.script.return_value = [[0, 0, 60000]]
+        self.assertFalse(limiter.allow("u"))
+        self.assertFalse(limiter.allow("u"))
+        self.script.assert_called_once_with(
+            keys=["app:bucket:u"], args=[2.0, 1, 10])
+
+    def check(self, limiter_class, *args, at):
+        """
+        Check one request of key u with a new limiter, as another
+        process would, when the Redis server clock reads at.
+        Returns whether it was allowed and the seconds until retry.
+        """
+        limiter = limiter_class(self.server_cache, *args)
+        with patch('time.time', return_value=at):
+            allowed = limiter.allow("u")
+        retry = limiter._blocked.get("u", time.monotonic())
+        return allowed, round(retry - time.monotonic(), 2)
+
+    def test_sliding_window_script(self):
+        """
+        Test the sliding window limit and retry times on a Redis
+        server that runs the script, and that it only uses its keys.
+        """
+        client = fakeredis.FakeRedis()
+        self.server_cache = Cache(client=client, namespace="app")
+        start = float(int(time.time()) + 10)
+        for _ in range(3):
+            self.assertEqual(self.check(SlidingWindowLimiter, 3, 1,
+                                        at=start), (True, 0))
+        self.assertEqual(self.check(SlidingWindowLimiter, 3, 1,
+                                    at=start + 0.5), (False, 0.5))
+        self.assertEqual(self.check(SlidingWindowLimiter, 3, 1,
+                                    at=start + 1.5), (True, 0))
+        self.assertEqual(self.check(SlidingWindowLimiter, 3, 1,
+                                    at=start + 1.5), (False, 0.17))
+        self.assertEqual(client.keys(), [b"app:rate:u"])
+        self.assertEqual(client.hgetall("app:rate:u")[b"current"], b"1")
+
+    def test_token_bucket_script(self):
+        """
+        Test the token bucket refill and retry times on a Redis
+        server that runs the script.
+        """
+        self.server_cache = Cache(client=fakeredis.FakeRedis())
+        start = float(int(time.time()) + 10)
+        for _ in range(2):
+            self.assertEqual(self.check(TokenBucketLimiter, 2, 1.0,
+                                        at=start), (True, 0))
+        self.assertEqual(self.check(TokenBucketLimiter, 2, 1.0,
+                                    at=start), (False, 1))
+        self.assertEqual(self.check(TokenBucketLimiter, 2, 1.0,
+                                    at=start + 0.5), (False, 0.5))
+        self.assertEqual(self.check(TokenBucketLimiter, 2, 1.0,
+                                    at=start + 1), (True, 0))
+
+
+class TestShardedCache(unittest.TestCase):
+    """
+    Unit tests for the ShardedCache class methods.
+    """
+
+    def setUp(self):
+        """
+        Set up a ShardedCache over three mocked Redis nodes.
+        """
+        self.nodes = []
+        for port in (7000, 7001, 7002):
+            node = MagicMock(spec=redis.Redis)
+            node.connection_pool = MagicMock(
+                connection_kwargs={"host": "localhost", "port": port})
+            node.mget.side_effect = lambda keys: [k.encode() for k in keys]
+            self.nodes.append(node)
+        self.cache = ShardedCache(self.nodes)
+        self.addCleanup(self.cache.close)
+
+    def test_ring_is_stable(self):
+        """
+        Test that adding a node only moves keys onto the new node.
+        """
+        keys = [str(i) for i in range(1000)]
+        ring = HashRing(["a", "b", "c"])
+        grown = HashRing(["a", "b", "c", "d"])
+        moved = [k for k in keys if ring.node(k) != grown.node(k)]
+        self.assertTrue(all(grown.node(k) == "d" for k in moved))
+        self.assertLess(len(moved), 400)
+
+    def test_store_routes_to_one_node(self):
+        """
+        Test that store writes to the key's node and counts on node 0.
+        """
+        key = self.cache.store("test_data")
+        self.cache.node(key).set.assert_called_once_with(key, "test_data")
+        self.assertEqual(sum(n.set.call_count for n in self.nodes), 1)
+        self.nodes[0].incr.assert_called_once_with("ShardedCache.store")
+        self.nodes[0].rpush.assert_any_call("ShardedCache.store:outputs", key)
+
+    def test_get_many_keeps_order(self):
+        """
+        Test that get_many reads every node and keeps the key order.
+        """
+        keys = [f"key{i}" for i in range(30)]
+        self.assertEqual(self.cache.get_many(keys, fn=bytes.decode), keys)
+        self.assertTrue(all(n.mget.call_count == 1 for n in self.nodes))
+
+    def test_duplicate_nodes(self):
+        """
+        Test that the same endpoint cannot be given twice.
+        """
+        with self.assertRaises(ValueError):
+            ShardedCache([self.nodes[0], self.nodes[0]])
+
+
+class TestAsyncCache(unittest.IsolatedAsyncioTestCase):
+    """
+    Unit tests for the AsyncCache class methods.
+    """
+
+    def setUp(self):
+        """
+        Set up an AsyncCache over a mocked asyncio Redis instance.
+        """
+        self.mock_redis = MagicMock(spec=redis.asyncio.Redis)
+        for command in ("get", "set", "incr", "rpush"):
+            setattr(self.mock_redis, command, AsyncMock())
+        self.cache = AsyncCache(client=self.mock_redis)
+
+    async def test_store(self):
+        """
+        Test that store counts the call, records history and sets data.
+        """
+        key = await self.cache.store("test_data")
+        self.mock_redis.incr.assert_awaited_once_with("AsyncCache.store")
+        self.mock_redis.set.assert_awaited_once_with(key, "test_data")
+        self.mock_redis.rpush.assert_any_await("AsyncCache.store:outputs", key)
+
+    async def test_get_int(self):
+        """
+        Test that get_int awaits the value and converts it.
+        """
+        self.mock_redis.get.return_value = b"123"
+        self.assertEqual(await self.cache.get_int("test_key"), 123)
+        self.mock_redis.get.assert_awaited_once_with("test_key")
+
+    async def test_get_str_of_missing_key(self):
+        """
+        Test that get_str returns None for a missing key, like Cache.
+        """
+        self.mock_redis.get.return_value = None
+        self.assertIsNone(await self.cache.get_str("test_key"))
+
+    def test_pool_per_event_loop(self):
+        """
+        Test that each event loop gets a pool of its own, so a
+        second asyncio.run does not reuse connections of a closed loop.
+        """
+        cache = AsyncCache()
+
+        async def pool():
+            return cache._redis.connection_pool
+
+        first = asyncio.run(pool())
+        second = asyncio.run(pool())
+        self.assertIsNot(first, second)
+
+
 if __name__ == '__main__':
     unittest.main()